@@ -10,37 +10,86 @@ TODO use PIL to create thumbnails https://pillow.readthedocs.io/en/stable/handbo
 """
 
 
-import src.activity as activity
-import src.render_track as track
+import src.helpers as helpers
+import src.jobs as jobs
+import src.parse_activity_file as parse_activity_file
+import src.store as store
 import configs.config as config
+import os
+import uuid
+import queue
 import logging
 
 
 
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request, jsonify
+from flask import stream_with_context
+from werkzeug.utils import secure_filename
 
+# pandas and the modules using it (activity, points_store, export, segments,
+# routes) are imported by the views, at the first request: see src.startup
+
+helpers.configure_logging()
 app = Flask(__name__)
+ingest = jobs.JobQueue(workers=2, maxsize=100)
+
+_store = None
+
+def get_store():
+    """Open the memory-mapped points store, once per worker process."""
+    import src.activity as activity
+    import src.points_store as points_store
+    global _store
+    if _store is None:
+        activity.ensure_points_store()
+        _store = points_store.PointsStore()
+    return(_store)
+
+route_index = None
+
+def get_route_index():
+    """Return the index of the routes, rebuilt when the store changes.
+
+    Only the routes table is read, and without db_lock, so a page does not
+    wait for the ingest workers.
+    """
+    import src.activity as activity
+    import src.routes as routes
+    global route_index
+    version = store.read_manifest()['version']
+    if route_index is None or route_index[0] != version:
+        route_index = (version, routes.RouteIndex.from_signatures(
+            activity.read_table('routes')))
+    return(route_index[1])
 
 @app.route('/')
 def index():
     return(render_template('base.html',
            links=config.LINKS))
 
+INDEX_COLUMNS = ['link',
+                 'sport',
+                 'start_time',
+                 'total_distance',
+                 'total_elapsed_time',
+                 'source_file_name',
+                 'avg_latitude',
+                 'avg_longitude']
+
 @app.route('/activities', methods=['GET', 'POST'])
 def activities_index():
     # TODO add an index on the left
-    db = activity.Activities(reset=False)
-    db.load_from_pickle()
-    db.build_from_folder(config.FOLDER_NAME, n=10)
-    db.activities['link'] = ['http://localhost:5000/' + str(i) for i in db.activities['activity_id']]
-    df = db.activities[['link',
-                  'sport',
-                  'start_time',
-                  'total_distance',
-                  'total_elapsed_time',
-                  'source_file_name',
-                  'avg_latitude',
-                  'avg_longitude']]
+    import src.activity as activity
+    # only the tables needed, not the points of the whole library
+    activities = activity.read_table('activities')
+    ingest.enqueue_folder(config.FOLDER_NAME, activities,
+                          activity.read_table('duplicates'))
+    if activities.empty:
+        # nothing committed yet, e.g. first visit while the jobs run
+        df = activities.reindex(columns=INDEX_COLUMNS)
+    else:
+        activities['link'] = ['http://localhost:5000/' + str(i) for i in activities['activity_id']]
+        df = activities[INDEX_COLUMNS]
     if request.method == 'POST':
         if request.form.get('action1') == 'VALUE1':
             logging.info('Action 1')
@@ -58,21 +107,133 @@ def activities_index():
 
 @app.route('/<int:track_id>')
 def show_track(track_id):
-    # create activity summary table
-    logging.info('Building database')
-    db = activity.Activities(reset=False)
-    db.load_from_pickle()
-    db.build_from_folder(config.FOLDER_NAME, n=10)
     logging.info('Creating activity points for trackID: ' + str(track_id))
-    activity_points = db.points[db.points['activity_id'] == track_id]
+    activity_points = get_store().get_points(track_id)
     logging.info('Creating map for trackID: ' + str(track_id))
+    # folium is slow to import: only when a map is shown
+    import src.render_track as track
     activity_map = track.create_map_with_track(activity_points)
     map_html = 'maps/' + str(track_id) + '_map.html'
     activity_map.save('templates/' + map_html)
+    similar = get_route_index().query(track_id)
+    similar = [('http://localhost:5000/' + str(i), round(score, 2))
+               for i, score in similar]
     return(render_template('activity.html',
                            map_template=map_html,
+                           similar=similar,
                            # table=df.to_html(render_links=True),
                            ))
 
+def save_upload(upload, folder: str, file_name: str) -> str:
+    """Save an upload without overwriting a file already in the folder.
+
+    Watches often reuse names (e.g. `activity.fit`): a name already taken
+    gets a unique prefix. Returns the path written.
+    """
+    file_path = os.path.join(folder, file_name)
+    while True:
+        try:
+            with open(file_path, 'xb') as file_obj:
+                upload.save(file_obj)
+            return(file_path)
+        except FileExistsError:
+            file_path = os.path.join(folder, uuid.uuid4().hex[:8] + '_' +
+                                     file_name)
+
+@app.route('/jobs', methods=['GET', 'POST'])
+def jobs_index():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if upload is None or not upload.filename:
+            return(jsonify(error='no file uploaded'), 400)
+        file_name = secure_filename(upload.filename)
+        if not file_name or not parse_activity_file.is_candidate(file_name):
+            return(jsonify(error='unsupported file name: ' +
+                           upload.filename), 400)
+        file_path = save_upload(upload, config.FOLDER_NAME, file_name)
+        try:
+            job = ingest.enqueue(file_path)
+        except queue.Full:
+            return(jsonify(error='job queue full, retry later'), 503)
+        return(jsonify(job.to_dict()), 202)
+    return(jsonify(progress=ingest.progress(),
+                   jobs=[job.to_dict()
+                         for job in list(ingest.jobs.values())]))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = ingest.get(job_id)
+    if job is None:
+        return(jsonify(error='unknown job'), 404)
+    return(jsonify(job.to_dict()))
+
+def parse_segment(segment):
+    """Return (name, start, end, radius) from a json body; ValueError if
+    invalid."""
+    try:
+        start = tuple(float(value) for value in segment['start'])
+        end = tuple(float(value) for value in segment['end'])
+        radius = float(segment.get('radius', 30.0))
+        name = str(segment['name'])
+    except (TypeError, KeyError, ValueError, AttributeError):
+        raise ValueError('expected {"name": ..., "start": [lat, lon], '
+                         '"end": [lat, lon], "radius": meters}')
+    if len(start) != 2 or len(end) != 2 or radius <= 0:
+        raise ValueError('start and end are [lat, lon], radius is positive')
+    return(name, start, end, radius)
+
+@app.route('/segments', methods=['GET', 'POST'])
+def segments_index():
+    """List the segments, or define one from a json body like
+    {"name": "climb", "start": [lat, lon], "end": [lat, lon], "radius": 30}.
+    """
+    import src.activity as activity
+    if request.method == 'POST':
+        try:
+            name, start, end, radius = parse_segment(
+                request.get_json(silent=True))
+        except ValueError as e:
+            return(jsonify(error=str(e)), 400)
+        with ingest.db_lock:
+            db = ingest.get_db()
+            with db.writing():
+                segment_id = db.add_segment(name, start, end, radius)
+        return(jsonify(segment_id=segment_id), 201)
+    table = activity.read_table('segments')
+    return(jsonify(table.to_dict(orient='records')))
+
+@app.route('/segments/<int:segment_id>')
+def segment_leaderboard(segment_id):
+    import src.activity as activity
+    import src.segments as segments
+    try:
+        n = int(request.args.get('n', 10))
+    except ValueError:
+        return(jsonify(error='n must be an integer'), 400)
+    efforts = segments.leaderboard(activity.read_table('efforts'),
+                                   segment_id, n=n)
+    efforts = efforts.assign(start_time=efforts['start_time'].astype(str))
+    return(jsonify(efforts.to_dict(orient='records')))
+
+@app.route('/export/<file_format>')
+def export_activities(file_format):
+    """Stream an export, e.g. /export/csv?table=laps&start=2021-01-01."""
+    import src.activity as activity
+    import src.export as export
+    activity.ensure_points_store()
+    try:
+        chunks = export.iter_export(file_format,
+                                    table=request.args.get('table', 'points'),
+                                    start=request.args.get('start'),
+                                    end=request.args.get('end'),
+                                    sport=request.args.get('sport'))
+    except ValueError as e:
+        return(jsonify(error=str(e)), 400)
+    file_name = 'activities.' + file_format
+    return(Response(stream_with_context(chunks),
+                    mimetype=export.FORMATS[file_format],
+                    headers={'Content-Disposition':
+                             'attachment; filename=' + file_name}))
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
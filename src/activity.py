@@ -14,25 +14,102 @@ https://github.com/polyvertex/fitdecode
 https://github.com/bunburya/fitness_tracker_data_parsing/blob/main/parse_fit.py
 """
 
-LOG_TO_FILE = True
-
 import os
+import contextlib
 import pandas as pd
 import logging
 from pathlib import Path
 import src.parse_activity_file as parse_activity_file
+import src.store as store
 import src.helpers as h
 
-if LOG_TO_FILE:
-    logging.basicConfig(filename='log.log',
-                        filemode="w",
-                        format='%(asctime)s %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p',
-                        level=logging.INFO)
-else:
-    logging.basicConfig(level=logging.DEBUG)
-    
-    
+# The subsystems (dedup, points_store, segments, routes, elevation) are
+# imported where they are used, so that importing this module costs only
+# pandas: see src.startup.
+
+# file names inside a version folder of the store, see src.store
+PICKLES = {'laps': 'laps.pickle',
+           'points': 'points.pickle',
+           'activities': 'activities.pikle',
+           'duplicates': 'duplicates.pickle',
+           'segments': 'segments.pickle',
+           'efforts': 'efforts.pickle',
+           'routes': 'routes.pickle'}
+
+# tables added after the first version; a missing pickle is not an error
+OPTIONAL_PICKLES = ['duplicates', 'segments', 'efforts', 'routes']
+
+def _empty_table(which: str) -> pd.DataFrame:
+    import src.segments as segments
+    columns = {'duplicates': ['source_file_name', 'activity_id'],
+               'segments': segments.SEGMENT_COLUMNS,
+               'efforts': segments.EFFORT_COLUMNS,
+               'routes': ['activity_id', 'signature']}.get(which, [])
+    return(pd.DataFrame(columns=columns))
+
+def _read_pickle(path: Path, which: str):
+    """Read a table; None if it is optional and was never written."""
+    if which in OPTIONAL_PICKLES and not path.exists():
+        if not path.parent.exists():
+            raise FileNotFoundError(path.parent)
+        logging.info('Pickle not found: ' + which)
+        return(None)
+    return(pd.read_pickle(path))
+
+def read_snapshot(read, attempts=5):
+    """Return (manifest, read(folder)) for the current version of the store.
+
+    A version folder removed by a writer while it was read (see
+    store.KEEP_VERSIONS) is retried on the version now current. Missing
+    pickles in the legacy layout, without manifest, raise FileNotFoundError.
+    """
+    for attempt in range(attempts):
+        manifest = store.read_manifest()
+        try:
+            return(manifest, read(store.get_folder(manifest)))
+        except(FileNotFoundError):
+            if manifest['folder'] is None:
+                raise
+            logging.info('Version {} removed while reading, '
+                         'retrying'.format(manifest['version']))
+    raise FileNotFoundError('Store changed during {} reads'.format(attempts))
+
+def read_table(which: str) -> pd.DataFrame:
+    """Read one table of the current snapshot, without the others.
+
+    A table never written is returned empty.
+    """
+    try:
+        _, table = read_snapshot(
+            lambda folder: _read_pickle(Path(folder)/PICKLES[which], which))
+    except(FileNotFoundError):
+        table = None
+    return(_empty_table(which) if table is None else table)
+
+def _completeness(activity: pd.DataFrame, laps: int, points: int) -> tuple:
+    """Rank of a record among duplicates of the same workout.
+
+    The record with a start time, laps and sport (the FIT from the watch)
+    comes first, as a GPX from the sync service has none of them; then the
+    one with more points.
+    """
+    def known(column):
+        return(column in activity and not activity[column].isna().all())
+    return(known('start_time'), laps > 0, known('sport'), points)
+
+def ensure_points_store():
+    """Write the points store if the current version has none.
+
+    Pickles written before the points store are committed as a new version,
+    which writes it.
+    """
+    import src.points_store as points_store
+    if not points_store.exists():
+        logging.info('Migrating the pickles to the points store')
+        db = Activities(reset=False)
+        with db.writing():
+            pass
+
 class Activity():
     def __init__(self):
         logging.info('Init activity')
@@ -41,6 +118,7 @@ class Activity():
         self.source_file_name = None
         self.source_file_extension = None
         self.id = None
+        self.digest = None
         self.activity = pd.DataFrame()
         self.laps = pd.DataFrame()
         self.points = pd.DataFrame()
@@ -54,8 +132,16 @@ class Activity():
         self.source_file_name = os.path.basename(source_file_path)
         self.source_file_extension = self._get_extension()
     
-    def get_hash(self):
-        return(hash(self))
+    def get_hash(self) -> int:
+        """Return an id derived from the sha1 of the source file content.
+
+        Stable across runs and processes, and the same for two copies of a
+        file; 60 bits, so it fits the int64 columns of the points store.
+        """
+        if self.digest is None:
+            self.digest = parse_activity_file.file_digest(
+                self.source_file_path)
+        return(int(self.digest[:15], 16))
     
 
     def create_from_file(self):
@@ -76,6 +162,19 @@ class Activity():
         logging.info('Parsing file: ' + self.source_file_name)
         file_path = self.source_file_path
         activity, laps, points = parse_activity_file.parse_file(file_path)
+        self.create_from_frames(activity, laps, points)
+
+    def create_from_frames(self, activity, laps, points, digest=None):
+        """Create the activity from dataframes already parsed.
+
+        Used when the parsing happened elsewhere (e.g. in another process).
+        
+        Args:
+            activity, laps, points: the dataframes from `parse_file`.
+            digest: sha1 of the source file, if already computed.
+        """
+        if digest is not None:
+            self.digest = digest
         self.id = self.get_hash()
         if not laps.empty:
             laps = laps.assign(activity_id=self.id)
@@ -102,6 +201,17 @@ class Activity():
     
     def remove_empty_points(self):
         self.points = self.points[self.points['latitude'] > 0]
+
+    def correct_elevation(self, cache, only_missing=False):
+        """Replace the altitude of the points with the DEM heights.
+        
+        Args:
+            cache: an elevation.TileCache on the DEM folder.
+            only_missing: replace only the missing altitudes.
+        """
+        import src.elevation as elevation
+        self.points = elevation.correct_points(self.points, cache,
+                                               only_missing=only_missing)
     
 class Activities():
     def __init__(self, reset=False):
@@ -113,40 +223,111 @@ class Activities():
         Returns:
             The three self.dataframes.
         """
-        self.activities = pd.DataFrame()
-        self.laps = pd.DataFrame()
-        self.points = pd.DataFrame()
-        self.pickles = {'laps': Path('.')/'pickles'/'laps.pickle',
-                        'points': Path('.')/'pickles'/'points.pickle',
-                        'activities': Path('.')/'pickles'/'activities.pikle'}
+        # self.activities, laps, points; duplicates (files skipped at
+        # ingest because duplicate of a stored activity); segments,
+        # efforts; routes (MinHash signature of the track of every activity)
+        self._set_tables({})
+        self.pickles = dict(PICKLES)
+        # snapshot loaded: version number and folder
+        self.version = None
+        self.folder = store.current_folder()
         if reset:
             self.save_to_pickle()
         else:
             self.load_from_pickle()
     
-    def _get_pickle_name(self, which: str) -> str:
-        return(self.pickles[which])
+    def _set_tables(self, tables: dict):
+        """Replace all the tables, empty where missing, and drop the
+        indexes built on the previous ones."""
+        for which in PICKLES:
+            table = tables.get(which)
+            setattr(self, which,
+                    _empty_table(which) if table is None else table)
+        self._duplicate_index = None
+        self._grid_index = None
+        self._route_index = None
+
+    def _get_pickle_name(self, which: str, folder=None) -> Path:
+        return(Path(folder or self.folder)/self.pickles[which])
     
     def load_from_pickle(self):
+        """Load the current snapshot of the store.
+
+        All the tables are read first and assigned only when every one was
+        read, so a failed load leaves the previous snapshot untouched.
+        """
         try:
-            logging.info('Retrieving from pickle')
-            self.activities = pd.read_pickle(self._get_pickle_name('activities'))
-            self.laps = pd.read_pickle(self._get_pickle_name('laps'))
-            self.points = pd.read_pickle(self._get_pickle_name('points'))
+            manifest, tables = read_snapshot(self._read_tables)
         except(FileNotFoundError):
+            manifest = store.read_manifest()
+            if manifest['folder'] is not None:
+                raise
+            # pickles not written yet, legacy layout
             logging.info('Pickle not found')
-                    
+            tables = {}
+        self._set_tables(tables)
+        self.version = manifest['version']
+        self.folder = store.get_folder(manifest)
+
+    def _read_tables(self, folder: Path) -> dict:
+        """Return the tables of a version folder by name."""
+        logging.info('Retrieving from pickle ' + str(folder))
+        return({which: _read_pickle(self._get_pickle_name(which, folder),
+                                    which)
+                for which in PICKLES})
+
+    def _write(self, folder: Path):
+        import src.points_store as points_store
+        # signatures of activities stored before the routes table, so that
+        # readers of the routes pickle alone find all of them
+        self._get_route_index()
+        for which in PICKLES:
+            getattr(self, which).to_pickle(self._get_pickle_name(which,
+                                                                 folder))
+        points_store.write(self.points, self.laps, folder/'store')
+
     def save_to_pickle(self):
+        """Commit the dataframes as a new version of the store.
+        
+        Raises store.ConflictError if another writer committed since the
+        snapshot was loaded; use `writing` to avoid it.
+        """
         logging.info('Saving data to pickle')
-        self.activities.to_pickle(self._get_pickle_name('activities'))
-        self.laps.to_pickle(self._get_pickle_name('laps'))
-        self.points.to_pickle(self._get_pickle_name('points'))
+        self.version = store.commit(self._write,
+                                    expected_version=self.version)
+        self.folder = store.current_folder()
+
+    @contextlib.contextmanager
+    def writing(self):
+        """Hold the store write lock, on the latest snapshot, and commit.
+
+        If the block (or the commit) fails, the snapshot is loaded again:
+        the partial changes are dropped instead of being committed by the
+        next `writing`.
+        
+        Usage:
+            with db.writing():
+                db.add_activity(session)
+        """
+        with store.WriteLock():
+            if store.read_manifest()['version'] != self.version:
+                self.load_from_pickle()
+            try:
+                yield(self)
+                self.save_to_pickle()
+            except BaseException:
+                self.load_from_pickle()
+                raise
     
     def check_activity_in_database(self,
                                    activity_id=None,
                                    file_name=None):
         logging.info('Checking activity in database:')
-        if self.activities.empty:
+        if file_name and file_name in \
+                self.duplicates['source_file_name'].values:
+            logging.info('  filename: ' + file_name + ' is a duplicate')
+            result = True
+        elif self.activities.empty:
             logging.info('self.activities is empty')
             result = False
         elif activity_id:
@@ -162,32 +343,219 @@ class Activities():
             result = False
         return(result)
 
+    def _get_duplicate_index(self):
+        import src.dedup as dedup
+        if self._duplicate_index is None:
+            self._duplicate_index = dedup.DuplicateIndex.from_points(
+                self.points)
+        return(self._duplicate_index)
+
+    def remove_activity(self, activity_id):
+        """Drop an activity, its laps and its points."""
+        self.activities = self.activities[
+            self.activities['activity_id'] != activity_id]
+        self.points = self.points[self.points['activity_id'] != activity_id]
+        if not self.laps.empty:
+            self.laps = self.laps[self.laps['activity_id'] != activity_id]
+        self.efforts = self.efforts[self.efforts['activity_id'] != activity_id]
+        self._get_duplicate_index().remove(activity_id)
+        self._get_grid_index().remove(activity_id)
+        self.routes = self.routes[self.routes['activity_id'] != activity_id]
+        self._get_route_index().remove(activity_id)
+
+    def add_activity(self, session: Activity):
+        """Append a parsed activity to the three dataframes.
+
+        If the activity duplicates one already stored (same workout from
+        another file), only the most complete is kept (with start time and
+        laps first, then with more points), and the file of the other is
+        recorded in self.duplicates.
+        
+        Args:
+            session: an Activity already created from its source file.
+
+        Returns:
+            The id of the activity kept.
+        """
+        return(self.add_activities([session])[0])
+
+    def add_activities(self, sessions: list) -> list:
+        """Append parsed activities, concatenating the dataframes once.
+
+        Same as calling `add_activity` on each session, duplicates included
+        (also between sessions of the batch), without copying the whole
+        database for every session.
+
+        Returns:
+            The ids of the activities kept, one per session.
+        """
+        import src.segments as segments
+        index = self._get_duplicate_index()
+        stored_ids = set(self.activities['activity_id']) \
+            if not self.activities.empty else set()
+        kept, ids = {}, []
+        for session in sessions:
+            if session.id in kept or session.id in stored_ids:
+                # same content as a stored file
+                logging.info('Skipping copy: ' + session.source_file_name)
+                self._flag_duplicate(session.source_file_name, session.id)
+                ids.append(session.id)
+                continue
+            duplicate_id = index.find(session.points)
+            if duplicate_id is not None:
+                if duplicate_id in kept:
+                    other = kept[duplicate_id]
+                    rank = _completeness(other.activity, len(other.laps),
+                                         len(other.points))
+                    file_name = other.source_file_name
+                else:
+                    stored = self.activities[
+                        self.activities['activity_id'] == duplicate_id]
+                    laps = (self.laps['activity_id'] == duplicate_id).sum() \
+                        if not self.laps.empty else 0
+                    rank = _completeness(
+                        stored, laps,
+                        (self.points['activity_id'] == duplicate_id).sum())
+                    file_name = stored['source_file_name'].iloc[0]
+                if _completeness(session.activity, len(session.laps),
+                                 len(session.points)) <= rank:
+                    logging.info('Skipping duplicate: ' +
+                                 session.source_file_name)
+                    self._flag_duplicate(session.source_file_name,
+                                         duplicate_id)
+                    ids.append(duplicate_id)
+                    continue
+                logging.info('Replacing duplicate: ' + file_name)
+                if duplicate_id in kept:
+                    del kept[duplicate_id]
+                    index.remove(duplicate_id)
+                else:
+                    self.remove_activity(duplicate_id)
+                    stored_ids.discard(duplicate_id)
+                self.duplicates.loc[
+                    self.duplicates['activity_id'] == duplicate_id,
+                    'activity_id'] = session.id
+                self._flag_duplicate(file_name, session.id)
+            index.add(session.id, session.points)
+            kept[session.id] = session
+            ids.append(session.id)
+        if kept:
+            added = list(kept.values())
+            self.activities = pd.concat([self.activities] +
+                                        [s.activity for s in added])
+            self.points = pd.concat([self.points] +
+                                    [s.points for s in added],
+                                    ignore_index=True)
+            self.laps = pd.concat([self.laps] + [s.laps for s in added],
+                                  ignore_index=True)
+            grid_index = self._get_grid_index()
+            for session in added:
+                grid_index.add(session.id, session.points)
+            self._add_routes([(s.id, s.points) for s in added])
+            self._add_efforts(pd.concat(
+                [segments.match_activity(self.segments, s.id, s.points)
+                 for s in added], ignore_index=True))
+        return(ids)
+
+    def _get_grid_index(self):
+        import src.segments as segments
+        if self._grid_index is None:
+            self._grid_index = segments.GridIndex.from_points(self.points)
+        return(self._grid_index)
+
+    def _get_route_index(self):
+        import src.routes as routes
+        if self._route_index is None:
+            self._route_index = routes.RouteIndex.from_signatures(self.routes)
+            # activities stored before the routes table existed
+            if not self.points.empty:
+                missing = self.points[~self.points['activity_id'].isin(
+                    self.routes['activity_id'])]
+                self._add_routes(missing.groupby('activity_id', sort=False))
+        return(self._route_index)
+
+    def _add_routes(self, tracks):
+        """Add the route signatures of (activity_id, points) pairs."""
+        import src.routes as routes
+        # building the index may already add them, from self.points
+        index = self._get_route_index()
+        rows = [(activity_id, routes.signature(routes.track_cells(points)))
+                for activity_id, points in tracks
+                if activity_id not in index.signatures]
+        if not rows:
+            return
+        added = pd.DataFrame({'activity_id': [row[0] for row in rows],
+                              'signature': [row[1] for row in rows]})
+        self.routes = pd.concat([self.routes, added], ignore_index=True)
+        for activity_id, value in rows:
+            index.add(activity_id, value)
+
+    def get_similar_routes(self, activity_id, n=5) -> list:
+        """Return up to n (activity_id, similarity) along the same route."""
+        return(self._get_route_index().query(activity_id, n=n))
+
+    def _add_efforts(self, efforts: pd.DataFrame):
+        if not efforts.empty:
+            self.efforts = pd.concat([self.efforts, efforts],
+                                     ignore_index=True)
+
+    def add_segment(self, name: str, start: tuple, end: tuple, radius=30.0):
+        """Define a segment and match it against all the activities.
+        
+        Args:
+            name: segment name.
+            start, end: (latitude, longitude) of the segment ends.
+            radius: distance in meters within which an end is reached.
+        
+        Returns:
+            The id of the new segment.
+        """
+        import src.segments as segments
+        segment_id = int(self.segments['segment_id'].max()) + 1 \
+            if not self.segments.empty else 1
+        segment = pd.Series({'segment_id': segment_id,
+                             'name': name,
+                             'start_latitude': start[0],
+                             'start_longitude': start[1],
+                             'end_latitude': end[0],
+                             'end_longitude': end[1],
+                             'radius': radius})
+        logging.info('Matching segment ' + name)
+        self.segments = pd.concat([self.segments, segment.to_frame().T],
+                                  ignore_index=True)
+        self._add_efforts(segments.match_segment(segment, self.points,
+                                                 self._get_grid_index()))
+        return(segment_id)
+
+    def get_leaderboard(self, segment_id: int, n=10) -> pd.DataFrame:
+        """Return the n fastest efforts on a segment."""
+        import src.segments as segments
+        return(segments.leaderboard(self.efforts, segment_id, n))
+
+    def _flag_duplicate(self, file_name: str, activity_id):
+        flagged = pd.DataFrame({'source_file_name': [file_name],
+                                'activity_id': [activity_id]})
+        self.duplicates = pd.concat([self.duplicates, flagged],
+                                    ignore_index=True)
+
     def build_from_folder(self, folder, n=3):
         """Iterate files in the folder, and create dataframe of results."""
         max_files, counter = n, 0
         directory = os.fsencode(folder)
         logging.info('Building database from folder ' + folder)
-        for file in os.listdir(directory):
-            file_name = os.fsdecode(file) 
-            if counter < max_files:
-                file_path = os.path.join(folder, file_name)
-                if not self.check_activity_in_database(file_name=file_name):
-                    session = Activity()
-                    session.define_source_file(file_path)
-                    session.create_from_file()
-                    session.remove_empty_points()
-                    self.activities = pd.concat([self.activities,
-                                                 session.activity],
-                                          # ignore_index=True,
-                                          )
-                    self.points = pd.concat([self.points, session.points],
-                                           ignore_index=True,
-                                          )
-                    self.laps = pd.concat([self.laps, session.laps],
-                                           ignore_index=True,
-                                          )
-                counter += 1
-        self.save_to_pickle()
+        with self.writing():
+            for file in os.listdir(directory):
+                file_name = os.fsdecode(file) 
+                if counter < max_files:
+                    file_path = os.path.join(folder, file_name)
+                    if not self.check_activity_in_database(
+                            file_name=file_name):
+                        session = Activity()
+                        session.define_source_file(file_path)
+                        session.create_from_file()
+                        session.remove_empty_points()
+                        self.add_activity(session)
+                    counter += 1
     
     
 # folder_name = 'C:\\dev\\techjournal\\data'
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Feed of activities by month for the calendar GUI.
+
+The activities table is read once, in a background thread, into an index
+sorted by start date: the activities of a month are then found with two
+bisects. Months are computed in the background too, and the results are
+put in a queue that the Tk main loop polls, so the GUI never blocks.
+"""
+
+import queue
+import bisect
+import logging
+import datetime as dt
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import src.activity as activity
+import src.helpers as h
+
+
+class DateIndex():
+    def __init__(self, activities: pd.DataFrame):
+        """Index the activities by start date; those without are skipped."""
+        self.dates, self.events = [], []
+        if activities.empty:
+            return
+        start_times = pd.to_datetime(activities['start_time'], utc=True)
+        rows = activities.assign(start_time=start_times)
+        rows = rows[rows['start_time'].notna()].sort_values('start_time')
+        for row in rows.itertuples(index=False):
+            self.dates.append(row.start_time.date())
+            self.events.append({'activity_id': row.activity_id,
+                                'date': row.start_time.date(),
+                                'text': '{} {} {}'.format(
+                                    row.sport,
+                                    h.pretty_length(row.total_distance),
+                                    h.pretty_duration(row.total_elapsed_time,
+                                                      light=True)),
+                                'sport': str(row.sport)})
+
+    def get_range(self, first: dt.date, last: dt.date) -> list:
+        """Return the events from first to last date, inclusive."""
+        start = bisect.bisect_left(self.dates, first)
+        end = bisect.bisect_right(self.dates, last)
+        return(self.events[start:end])
+
+    def get_month(self, year: int, month: int) -> list:
+        first = dt.date(year, month, 1)
+        last = _shift(year, month, 1) - dt.timedelta(days=1)
+        return(self.get_range(first, last))
+
+
+def _shift(year: int, month: int, months: int) -> dt.date:
+    """Return the first day of the month shifted by some months."""
+    index = year * 12 + month - 1 + months
+    return(dt.date(index // 12, index % 12 + 1, 1))
+
+
+class CalendarFeed():
+    def __init__(self):
+        """Start loading the index in a background thread."""
+        self.results = queue.Queue()
+        self._months = {}
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._index = self._pool.submit(self._load)
+
+    def _load(self) -> DateIndex:
+        # same snapshot rules as the other readers: a version removed while
+        # it is read is retried, a table never written is empty
+        return(DateIndex(activity.read_table('activities')))
+
+    def _compute(self, year: int, month: int):
+        # the executor keeps exceptions in futures nobody reads: log them
+        try:
+            events = self._index.result().get_month(year, month)
+        except Exception:
+            logging.exception('Calendar month {}-{} failed'.format(year,
+                                                                   month))
+            # asked again at the next request
+            self._months.pop((year, month), None)
+            return
+        self.results.put(((year, month), events))
+
+    def request(self, year: int, month: int, prefetch=1):
+        """Queue the month and the adjacent ones, if not already done.
+
+        The results arrive in self.results as ((year, month), events).
+        """
+        for months in range(-prefetch, prefetch + 1):
+            day = _shift(year, month, months)
+            key = (day.year, day.month)
+            if key not in self._months:
+                self._months[key] = None
+                self._pool.submit(self._compute, *key)
+
+    def poll(self) -> list:
+        """Store the months computed so far; return their keys."""
+        ready = []
+        while True:
+            try:
+                key, events = self.results.get_nowait()
+            except queue.Empty:
+                return(ready)
+            self._months[key] = events
+            ready.append(key)
+
+    def get(self, year: int, month: int):
+        """Return the events of a month, or None if not loaded yet."""
+        return(self._months.get((year, month)))
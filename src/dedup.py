@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Detection of duplicate activities recorded in different files.
+
+The same workout often arrives both as a FIT from the watch and as a
+TCX/GPX from the sync service. Two activities are duplicates when their
+time ranges overlap almost completely and their tracks pass through the
+same places.
+
+Candidates are found with an index of the time ranges sorted by start
+time: an activity can only overlap another one starting less than the
+longest duration before it, so a bisect bounds the search. Candidates are
+then compared on a fingerprint of the track, the set of grid cells it
+crosses.
+"""
+
+import bisect
+import logging
+import pandas as pd
+import src.routes as routes
+
+
+def track_fingerprint(points: pd.DataFrame) -> set:
+    """Return all the grid cells (~200m) the track crosses.
+
+    Every point is used, not a sample: the same workout recorded at
+    different rates (e.g. 1s on the watch, 5s by the sync service) crosses
+    the same cells, while samples taken every n points would not fall on
+    the same places.
+    """
+    return(set(routes.track_cells(points).tolist()))
+
+
+def time_range(points: pd.DataFrame):
+    """Return the (start, end) of the track as epoch seconds, or None."""
+    if 'timestamp' not in points or points['timestamp'].isna().all():
+        return(None)
+    timestamps = pd.to_datetime(points['timestamp'], utc=True)
+    return(timestamps.min().timestamp(), timestamps.max().timestamp())
+
+
+class DuplicateIndex():
+    def __init__(self, min_overlap=0.8, min_similarity=0.7):
+        """Create an empty index.
+
+        Args:
+            min_overlap: minimum fraction of the shorter time range covered
+                by the other one.
+            min_similarity: minimum share of fingerprint cells in common
+                (Jaccard index).
+        """
+        self.min_overlap = min_overlap
+        self.min_similarity = min_similarity
+        self._starts = []
+        self._entries = []
+        self._max_duration = 0.0
+
+    @classmethod
+    def from_points(cls, points: pd.DataFrame, **kwargs):
+        """Build the index from the points of all the activities."""
+        index = cls(**kwargs)
+        if points.empty:
+            return(index)
+        for activity_id, activity_points in points.groupby('activity_id',
+                                                           sort=False):
+            index.add(activity_id, activity_points)
+        return(index)
+
+    def add(self, activity_id, points: pd.DataFrame):
+        span = time_range(points)
+        if span is None:
+            return
+        position = bisect.bisect(self._starts, span[0])
+        self._starts.insert(position, span[0])
+        self._entries.insert(position,
+                             (span, track_fingerprint(points), activity_id))
+        self._max_duration = max(self._max_duration, span[1] - span[0])
+
+    def remove(self, activity_id):
+        for position, entry in enumerate(self._entries):
+            if entry[2] == activity_id:
+                del self._starts[position], self._entries[position]
+                return
+
+    def find(self, points: pd.DataFrame):
+        """Return the id of an activity duplicate of the points, or None."""
+        span = time_range(points)
+        if span is None:
+            return(None)
+        fingerprint = track_fingerprint(points)
+        first = bisect.bisect_left(self._starts, span[0] - self._max_duration)
+        last = bisect.bisect_left(self._starts, span[1])
+        for (start, end), other, activity_id in self._entries[first:last]:
+            overlap = min(end, span[1]) - max(start, span[0])
+            shorter = min(end - start, span[1] - span[0])
+            if shorter <= 0 or overlap / shorter < self.min_overlap:
+                continue
+            union = fingerprint | other
+            if union and len(fingerprint & other) / len(union) \
+                    >= self.min_similarity:
+                logging.info('Duplicate of activity ' + str(activity_id))
+                return(activity_id)
+        return(None)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Elevation correction from a local digital elevation model (DEM).
+
+The DEM is a folder of SRTM `.hgt` tiles (e.g. `N45E007.hgt`, named after
+the south-west corner): squares of 1201x1201 or 3601x3601 big-endian int16
+heights in meters, north row first. Tiles are memory-mapped and kept in a
+small LRU cache; all the points falling in a tile are interpolated at once
+(bilinear), so whole-library backfills need no per-point work and no
+network.
+
+Usage:
+    python -m src.elevation C:\\dev\\techjournal\\dem --only-missing
+"""
+
+import os
+import sys
+import logging
+import argparse
+import collections
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import src.helpers as helpers
+
+VOID = -32768
+
+
+def tile_name(latitude: int, longitude: int) -> str:
+    return('{}{:02d}{}{:03d}.hgt'.format('N' if latitude >= 0 else 'S',
+                                         abs(latitude),
+                                         'E' if longitude >= 0 else 'W',
+                                         abs(longitude)))
+
+
+class TileCache():
+    def __init__(self, folder, max_tiles=16):
+        """Open tiles lazily from the folder.
+
+        Args:
+            folder: folder of the .hgt tiles.
+            max_tiles: tiles kept memory-mapped at the same time.
+        """
+        self.folder = Path(folder)
+        self.max_tiles = max_tiles
+        self._tiles = collections.OrderedDict()
+
+    def get(self, latitude: int, longitude: int):
+        """Return the tile with the south-west corner given, or None."""
+        key = (latitude, longitude)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return(self._tiles[key])
+        path = self.folder / tile_name(latitude, longitude)
+        if path.exists():
+            side = int(round(np.sqrt(os.path.getsize(path) / 2)))
+            tile = np.memmap(path, dtype='>i2', mode='r', shape=(side, side))
+        else:
+            logging.info('DEM tile not found: ' + path.name)
+            tile = None
+        self._tiles[key] = tile
+        if len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return(tile)
+
+    def sample(self, latitudes, longitudes) -> np.ndarray:
+        """Return the DEM heights of the positions; NaN where unknown."""
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        heights = np.full(latitudes.shape, np.nan)
+        valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        corners = np.stack([np.floor(latitudes[valid]),
+                            np.floor(longitudes[valid])], axis=1)
+        positions = np.flatnonzero(valid)
+        if positions.size == 0:
+            return(heights)
+        tiles, inverse = np.unique(corners, axis=0, return_inverse=True)
+        for number, (latitude, longitude) in enumerate(tiles):
+            tile = self.get(int(latitude), int(longitude))
+            if tile is None:
+                continue
+            selected = positions[inverse.ravel() == number]
+            heights[selected] = _interpolate(tile,
+                                             latitudes[selected] - latitude,
+                                             longitudes[selected] - longitude)
+        return(heights)
+
+
+def _interpolate(tile: np.ndarray, dy: np.ndarray, dx: np.ndarray):
+    """Bilinear interpolation at offsets in [0, 1) from the SW corner."""
+    last = tile.shape[0] - 1
+    rows = (1 - dy) * last
+    columns = dx * last
+    r0 = np.clip(np.floor(rows).astype(int), 0, last - 1)
+    c0 = np.clip(np.floor(columns).astype(int), 0, last - 1)
+    fr, fc = rows - r0, columns - c0
+    corners = [tile[r0, c0], tile[r0, c0 + 1],
+               tile[r0 + 1, c0], tile[r0 + 1, c0 + 1]]
+    void = np.zeros(dy.shape, dtype=bool)
+    for corner in corners:
+        void |= corner == VOID
+    corners = [corner.astype(float) for corner in corners]
+    heights = (corners[0] * (1 - fr) * (1 - fc) + corners[1] * (1 - fr) * fc +
+               corners[2] * fr * (1 - fc) + corners[3] * fr * fc)
+    heights[void] = np.nan
+    return(heights)
+
+
+def correct_points(points: pd.DataFrame, cache: TileCache,
+                   only_missing=False) -> pd.DataFrame:
+    """Return the points with the altitude taken from the DEM.
+
+    Args:
+        points: dataframe with latitude, longitude and altitude.
+        cache: the DEM tiles.
+        only_missing: replace only the missing altitudes.
+
+    Where the DEM has no data the original altitude is kept.
+    """
+    if points.empty:
+        return(points)
+    heights = cache.sample(points['latitude'], points['longitude'])
+    # a copy: with copy-on-write, to_numpy may return a read-only view
+    altitude = pd.to_numeric(points['altitude'], errors='coerce').to_numpy(
+        dtype=float, copy=True)
+    replace = ~np.isnan(heights)
+    if only_missing:
+        replace &= np.isnan(altitude)
+    altitude[replace] = heights[replace]
+    return(points.assign(altitude=altitude))
+
+
+def main(argv=None):
+    import src.activity as activity
+    parser = argparse.ArgumentParser(
+        description='Correct the altitude of all the points from a DEM.')
+    parser.add_argument('dem', help='folder of the SRTM .hgt tiles')
+    parser.add_argument('--only-missing', action='store_true',
+                        help='replace only the missing altitudes')
+    args = parser.parse_args(argv)
+    helpers.configure_logging()
+    db = activity.Activities(reset=False)
+    with db.writing():
+        db.points = correct_points(db.points, TileCache(args.dem),
+                                   only_missing=args.only_missing)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Streaming export of activities, laps and points.
+
+The exports are generators of text chunks: the activities table is read
+from its pickle, then laps and points are read one activity at a time from
+the memory-mapped points store, so exporting the full history uses bounded
+memory and the first bytes are available immediately. The same generators
+back the Flask endpoints and the command line.
+
+Every export opens its own points store and keeps the version it opened,
+so all the rows come from the same snapshot even if a new version is
+committed while it streams.
+
+Usage:
+    python -m src.export geojson all.geojson --start 2021-01-01 --sport running
+"""
+
+import io
+import sys
+import csv
+import json
+import math
+import argparse
+import pandas as pd
+from xml.sax.saxutils import escape
+import src.activity as activity
+import src.helpers as helpers
+import src.points_store as points_store
+
+FORMATS = {'geojson': 'application/geo+json',
+           'gpx': 'application/gpx+xml',
+           'csv': 'text/csv'}
+
+TABLES = ('activities', 'laps', 'points')
+
+
+def load_activities(folder, start=None, end=None,
+                    sport=None) -> pd.DataFrame:
+    """Return the activities table filtered by date range and sport.
+
+    Args:
+        folder: folder of the version of the pickles to read.
+        start, end: dates (anything `pandas.Timestamp` accepts), inclusive.
+        sport: sport name as stored, e.g. 'running'.
+    """
+    activities = pd.read_pickle(folder/activity.PICKLES['activities'])
+    if activities.empty:
+        return(activities)
+    start_time = pd.to_datetime(activities['start_time'], utc=True)
+    mask = pd.Series(True, index=activities.index)
+    if start is not None:
+        mask &= start_time >= pd.Timestamp(start, tz='UTC')
+    if end is not None:
+        mask &= start_time < pd.Timestamp(end, tz='UTC') + pd.Timedelta(days=1)
+    if sport is not None:
+        mask &= activities['sport'] == sport
+    return(activities[mask.values])
+
+
+def _json_value(value):
+    if value is pd.NaT:
+        # not a Timestamp, and str() would give 'NaT'
+        return(None)
+    if isinstance(value, pd.Timestamp):
+        return(None if pd.isna(value) else value.isoformat())
+    if isinstance(value, float) and math.isnan(value):
+        return(None)
+    if hasattr(value, 'item'):
+        # numpy scalar
+        return(_json_value(value.item()))
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return(value)
+    return(str(value))
+
+
+def iter_geojson(activities: pd.DataFrame, store: points_store.PointsStore):
+    """Yield a FeatureCollection with one LineString per activity."""
+    yield('{"type": "FeatureCollection", "features": [\n')
+    separator = ''
+    for _, row in activities.iterrows():
+        points = store.points.get(row['activity_id'])
+        coordinates = [[lon, lat] for lat, lon in
+                       zip(points['latitude'].tolist(),
+                           points['longitude'].tolist())]
+        feature = {'type': 'Feature',
+                   'geometry': {'type': 'LineString',
+                                'coordinates': coordinates},
+                   'properties': {key: _json_value(value)
+                                  for key, value in row.items()}}
+        yield(separator + json.dumps(feature))
+        separator = ',\n'
+    yield('\n]}\n')
+
+
+def iter_gpx(activities: pd.DataFrame, store: points_store.PointsStore):
+    """Yield a GPX document with one track per activity."""
+    yield('<?xml version="1.0" encoding="UTF-8"?>\n'
+          '<gpx version="1.1" creator="techjournal" '
+          'xmlns="http://www.topografix.com/GPX/1/1">\n')
+    for _, row in activities.iterrows():
+        points = store.points.get_frame(row['activity_id'])
+        chunk = ['<trk><name>{}</name><type>{}</type><trkseg>\n'.format(
+                     escape(str(row['source_file_name'])),
+                     escape(str(row['sport'])))]
+        for point in points.itertuples(index=False):
+            chunk.append('<trkpt lat="{:.7f}" lon="{:.7f}">'.format(
+                point.latitude, point.longitude))
+            if not pd.isna(point.altitude):
+                chunk.append('<ele>{}</ele>'.format(point.altitude))
+            if not pd.isna(point.timestamp):
+                chunk.append('<time>{}</time>'.format(
+                    point.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')))
+            chunk.append('</trkpt>\n')
+        chunk.append('</trkseg></trk>\n')
+        yield(''.join(chunk))
+    yield('</gpx>\n')
+
+
+def iter_csv(activities: pd.DataFrame, store: points_store.PointsStore,
+             table='points'):
+    """Yield the rows of a table as CSV, one activity per chunk."""
+    if table == 'activities':
+        for position in range(0, len(activities), 1000):
+            buffer = io.StringIO()
+            activities.iloc[position:position + 1000].to_csv(
+                buffer, index=False, header=position == 0)
+            yield(buffer.getvalue())
+        return
+    if activities.empty:
+        # the table of a store never written has no columns
+        return
+    header = True
+    for activity_id in activities['activity_id']:
+        if table == 'laps':
+            df = store.laps.get_frame(activity_id)
+        else:
+            df = store.points.get_frame(activity_id)
+        if df.empty:
+            continue
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=header,
+                  quoting=csv.QUOTE_MINIMAL)
+        header = False
+        yield(buffer.getvalue())
+
+
+def _open_snapshot(start, end, sport, attempts=5):
+    """Return a points store and the activities of the same version."""
+    for attempt in range(attempts):
+        store = points_store.PointsStore()
+        try:
+            return(store, load_activities(store.folder, start, end, sport))
+        except FileNotFoundError:
+            # version removed meanwhile by a writer, see src.store
+            continue
+    raise FileNotFoundError('Store changed during {} reads'.format(attempts))
+
+
+def iter_export(file_format: str, table='points', start=None, end=None,
+                sport=None):
+    """Yield the chunks of an export.
+
+    Args:
+        file_format: one of FORMATS.
+        table: for csv, one of TABLES.
+        start, end, sport: filters, see `load_activities`.
+    """
+    if file_format not in FORMATS:
+        raise ValueError('Unknown export format: ' + file_format)
+    if table not in TABLES:
+        raise ValueError('Unknown table: ' + table)
+    # a private store, never refreshed: the version stays pinned
+    store, activities = _open_snapshot(start, end, sport)
+    if file_format == 'geojson':
+        return(iter_geojson(activities, store))
+    if file_format == 'gpx':
+        return(iter_gpx(activities, store))
+    return(iter_csv(activities, store, table))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export activities.')
+    parser.add_argument('format', choices=FORMATS)
+    parser.add_argument('output', help="output file, '-' for stdout")
+    parser.add_argument('--table', choices=TABLES, default='points',
+                        help='table exported as csv')
+    parser.add_argument('--start', help='first date, e.g. 2021-01-01')
+    parser.add_argument('--end', help='last date, e.g. 2021-12-31')
+    parser.add_argument('--sport', help="e.g. 'running'")
+    args = parser.parse_args(argv)
+    helpers.configure_logging()
+    activity.ensure_points_store()
+    chunks = iter_export(args.format, args.table, args.start, args.end,
+                         args.sport)
+    if args.output == '-':
+        sys.stdout.writelines(chunks)
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='') as file_obj:
+            file_obj.writelines(chunks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,10 @@ import tkinter as tk
 from tkinter import ttk
 
 from tkcalendar import Calendar
+import src.calendar_feed as calendar_feed
+import src.helpers as helpers
+
+helpers.configure_logging()
 
 app_window = tk.Tk()
 s = ttk.Style(app_window)
@@ -35,13 +39,33 @@ ttk.Button(app_window,
               style="C.TButton",
               command=app_window.destroy).pack(padx=10, pady=10)
 
-date = cal.datetime.today() + cal.timedelta(days=2)
-cal.calevent_create(date, 'Hello World', 'message')
-cal.calevent_create(date, 'Reminder 2', 'reminder')
-cal.calevent_create(date + cal.timedelta(days=-2), 'Reminder 1', 'reminder')
-cal.calevent_create(date + cal.timedelta(days=3), 'Message', 'message')
-
-cal.tag_config('reminder', background='red', foreground='yellow')
+feed = calendar_feed.CalendarFeed()
+
+def show_displayed_month():
+    """Show the events of the displayed month only, if already loaded."""
+    month, year = cal.get_displayed_month()
+    cal.calevent_remove('all')
+    events = feed.get(year, month)
+    if events is not None:
+        for event in events:
+            cal.calevent_create(event['date'], event['text'], 'activity')
+
+def month_changed(event=None):
+    month, year = cal.get_displayed_month()
+    feed.request(year, month)
+    show_displayed_month()
+
+def poll_feed():
+    """Pick up the months loaded in background, without blocking Tk."""
+    month, year = cal.get_displayed_month()
+    if (year, month) in feed.poll():
+        show_displayed_month()
+    app_window.after(100, poll_feed)
+
+cal.bind('<<CalendarMonthChanged>>', month_changed)
+cal.tag_config('activity', background='red', foreground='yellow')
+month_changed()
+poll_feed()
 
 cal.pack(fill="both", expand=True)
 ttk.Label(cal, text="Hover over the events.").pack()
@@ -5,11 +5,24 @@ Created on Mon Feb 28 07:36:17 2022
 @author: c740
 """
 
-import datetime as dt
-import pandas as pd
 import math
+import logging
+import datetime as dt
+
+LOG_TO_FILE = True
 
 
+def configure_logging(to_file=LOG_TO_FILE):
+    """Set up the logging; called by the entry points, not at import."""
+    if to_file:
+        logging.basicConfig(filename='log.log',
+                            filemode="w",
+                            format='%(asctime)s %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S %p',
+                            level=logging.INFO)
+    else:
+        logging.basicConfig(level=logging.DEBUG)
+
 def pretty_duration(s: float, fmt='{}h:{}m:{}s', light=False) -> str:
     if math.isnan(s):
         return('Not a number')
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Command-line bulk importer of activity files.
+
+Walk a directory tree recursively, parse every supported file in a pool of
+processes and add it to the `Activities` database; zip archives are read
+member by member, without extraction. The database is saved every `--batch`
+files together with a checkpoint listing the files already handled, so an
+interrupted import (crash or Ctrl-C) resumes where it stopped.
+
+Usage:
+    python -m src.importer C:\\dev\\techjournal\\data --workers 4
+    python -m src.importer C:\\dev\\techjournal\\data --dry-run
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+import src.helpers as helpers
+import src.parse_activity_file as parse_activity_file
+
+CHECKPOINT = Path('.')/'pickles'/'import_checkpoint.json'
+
+
+def find_files(folder: str) -> list:
+    """Return the sorted paths of the supported files under the folder.
+
+    Zip archives are expanded in the paths of their members.
+    """
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            if parse_activity_file.is_candidate(name):
+                files.extend(parse_activity_file.list_sources(
+                    os.path.join(root, name)))
+    return(files)
+
+
+def load_checkpoint(checkpoint: Path) -> dict:
+    try:
+        with open(checkpoint) as file_obj:
+            return(json.load(file_obj))
+    except FileNotFoundError:
+        return({'done': [], 'failed': []})
+
+
+def save_checkpoint(checkpoint: Path, state: dict):
+    """Write the checkpoint to a temporary file, then rename it."""
+    tmp = checkpoint.with_suffix('.tmp')
+    with open(tmp, 'w') as file_obj:
+        json.dump(state, file_obj)
+    os.replace(tmp, checkpoint)
+
+
+def run(folder: str, batch=50, workers=None, dry_run=False,
+        checkpoint=CHECKPOINT, dem=None):
+    """Import the folder tree in the database.
+
+    Args:
+        folder: root of the tree to import.
+        batch: number of files parsed between two saves of the database.
+        workers: number of parsing processes (default: cpu count).
+        dry_run: only report the files that would be parsed.
+        checkpoint: path of the checkpoint file.
+        dem: folder of SRTM tiles to correct the altitudes, if given.
+
+    Returns:
+        The state of the checkpoint at the end of the run.
+    """
+    # pandas only once there is something to import: --help stays instant
+    import src.activity as activity
+    import src.elevation as elevation
+    state = load_checkpoint(checkpoint)
+    handled = set(state['done']) | set(state['failed'])
+    db = activity.Activities(reset=False)
+    todo = [f for f in find_files(folder)
+            if f not in handled and
+            not db.check_activity_in_database(
+                file_name=os.path.basename(f))]
+    print('{} files to import, {} already done'.format(len(todo),
+                                                       len(handled)))
+    if dry_run:
+        for file_path in todo:
+            print('  ' + file_path)
+        return(state)
+    cache = elevation.TileCache(dem) if dem else None
+    start, count = time.time(), 0
+    pending = []
+
+    def commit():
+        # every commit rewrites the whole store: never for nothing
+        if not pending:
+            save_checkpoint(checkpoint, state)
+            return
+        # the store may have been committed by the app meanwhile: writing()
+        # reloads the latest version before adding the batch
+        with db.writing():
+            db.add_activities([session for _, session in pending])
+        state['done'].extend(file_path for file_path, _ in pending)
+        save_checkpoint(checkpoint, state)
+        pending.clear()
+
+    try:
+        for file_path, frames, error in parse_activity_file.parse_many(
+                todo, workers=workers):
+            count += 1
+            if error is None:
+                session = activity.Activity()
+                session.define_source_file(file_path)
+                session.create_from_frames(*frames)
+                session.remove_empty_points()
+                if cache is not None:
+                    session.correct_elevation(cache)
+                pending.append((file_path, session))
+            else:
+                logging.error('Import failed: ' + file_path + ' ' + error)
+                state['failed'].append(file_path)
+            if count % batch == 0:
+                commit()
+            rate = count / (time.time() - start)
+            print('\r{}/{} files, {:.1f} files/s'.format(count,
+                                                         len(todo),
+                                                         rate),
+                  end='', flush=True)
+    except KeyboardInterrupt:
+        print('\nInterrupted, saving checkpoint')
+    finally:
+        commit()
+    print('\n{} files imported, {} failed'.format(len(state['done']),
+                                                 len(state['failed'])))
+    return(state)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import activities.')
+    parser.add_argument('folder', help='root folder of the activity files')
+    parser.add_argument('--batch', type=int, default=50,
+                        help='files parsed between two saves')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='parsing processes (default: cpu count)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only list the files that would be parsed')
+    parser.add_argument('--checkpoint', type=Path, default=CHECKPOINT,
+                        help='checkpoint file')
+    parser.add_argument('--dem', help='folder of SRTM .hgt tiles used to '
+                        'correct the altitudes')
+    args = parser.parse_args(argv)
+    helpers.configure_logging()
+    run(args.folder, batch=args.batch, workers=args.workers,
+        dry_run=args.dry_run, checkpoint=args.checkpoint, dem=args.dem)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Background ingest of activity files.
+
+Files are pushed as jobs in a bounded queue and consumed by a pool of
+worker threads, which parse them with `Activity.create_from_file` and merge
+the results in a shared `Activities` database. HTTP requests only enqueue
+and return immediately; the status of each job can be polled.
+
+Enqueueing does not read the files: the workers compute the content digest.
+A path already queued or running returns the in-flight job, and a file with
+the same content as one already running is not parsed twice. Files that
+failed are remembered by path and modification stamp, and their content by
+digest, so that they are not queued and parsed again at every scan of the
+folder. Only the last `MAX_FINISHED` finished jobs are kept.
+
+The parsed sessions are committed in batches: whoever takes the database
+lock adds all the sessions parsed meanwhile in one version of the store.
+"""
+
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+import collections
+from pathlib import Path
+import src.parse_activity_file as parse_activity_file
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+MAX_FINISHED = 1000
+
+
+def file_stamp(file_path):
+    """Return (mtime, size) of the file, or of the zip archive holding it."""
+    path = Path(file_path)
+    for candidate in [path] + list(path.parents):
+        try:
+            stat = candidate.stat()
+        except OSError:
+            continue
+        return((stat.st_mtime_ns, stat.st_size))
+    return(None)
+
+
+class Job():
+    def __init__(self, file_path: str):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self.stamp = file_stamp(file_path)
+        self.digest = None
+        self.status = QUEUED
+        self.progress = 0.0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self) -> dict:
+        return({'id': self.id,
+                'file_name': self.file_name,
+                'status': self.status,
+                'progress': self.progress,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished})
+
+
+class JobQueue():
+    def __init__(self, workers=2, maxsize=100):
+        """Start the worker pool.
+
+        Args:
+            workers: number of worker threads parsing files.
+            maxsize: maximum number of jobs waiting in the queue; when full,
+                `enqueue` raises `queue.Full`.
+        """
+        self.jobs = {}
+        self._queue = queue.Queue(maxsize=maxsize)
+        # in-flight jobs by path, and by digest once computed
+        self._in_flight = {}
+        self._running = {}
+        # failed files: stamp by path, and digests
+        self._failed = {}
+        self._failed_digests = set()
+        self._finished = collections.deque()
+        # parsed sessions waiting to be committed
+        self._parsed = []
+        self._lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work,
+                                          name='ingest-' + str(i),
+                                          daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def get_db(self):
+        """Load the database to write to; hold db_lock.
+
+        Not kept between commits: every process of the app would otherwise
+        hold a full copy of the library.
+        """
+        # pandas is loaded by the workers, not by importing this module
+        import src.activity as activity
+        return(activity.Activities(reset=False))
+
+    def enqueue(self, file_path: str) -> Job:
+        """Queue a file for parsing, or return the in-flight job."""
+        with self._lock:
+            if file_path in self._in_flight:
+                logging.info('Job already in flight for ' + file_path)
+                return(self._in_flight[file_path])
+            job = Job(file_path)
+            self._queue.put_nowait(job)
+            self.jobs[job.id] = job
+            self._in_flight[file_path] = job
+        logging.info('Job ' + job.id + ' queued for ' + file_path)
+        return(job)
+
+    def has_failed(self, file_path: str) -> bool:
+        """Tell if the file failed and did not change since."""
+        stamp = self._failed.get(file_path)
+        return(stamp is not None and stamp == file_stamp(file_path))
+
+    def enqueue_folder(self, folder: str, activities,
+                       duplicates=None) -> list:
+        """Queue every file in the folder not yet in the database.
+
+        Args:
+            folder: folder of the activity files.
+            activities, duplicates: the tables of the database (see
+                `activity.read_table`); their files are not queued.
+
+        Zip archives are expanded in their members. Files that failed are
+        skipped until they change. Stops silently when the queue is full;
+        remaining files are picked up at the next call.
+        """
+        known = set()
+        for table in (activities, duplicates):
+            if table is not None and 'source_file_name' in table:
+                known.update(table['source_file_name'])
+        jobs = []
+        for name in sorted(os.listdir(folder)):
+            if not parse_activity_file.is_candidate(name) or \
+                    not os.path.isfile(os.path.join(folder, name)):
+                continue
+            for file_path in parse_activity_file.list_sources(
+                    os.path.join(folder, name)):
+                file_name = os.path.basename(file_path)
+                if self.has_failed(file_path) or file_name in known:
+                    continue
+                try:
+                    jobs.append(self.enqueue(file_path))
+                except queue.Full:
+                    logging.info('Job queue full')
+                    return(jobs)
+        return(jobs)
+
+    def get(self, job_id: str):
+        return(self.jobs.get(job_id))
+
+    def progress(self) -> dict:
+        """Return the count of jobs per status."""
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        with self._lock:
+            for job in self.jobs.values():
+                counts[job.status] += 1
+        counts['total'] = len(self.jobs)
+        return(counts)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(job.file_path, None)
+                    if self._running.get(job.digest) is job:
+                        del self._running[job.digest]
+                self._queue.task_done()
+                if self._queue.empty():
+                    # do not keep a zip archive open while idle
+                    parse_activity_file.close_archive()
+
+    def _start(self, job: Job) -> bool:
+        """Hash the file; return False if it needs no parsing."""
+        job.digest = parse_activity_file.file_digest(job.file_path)
+        with self._lock:
+            if job.digest in self._failed_digests:
+                raise ValueError('same content as a file that failed')
+            other = self._running.get(job.digest)
+            if other is not None:
+                logging.info('Job ' + job.id + ' same content as job ' +
+                             other.id)
+                return(False)
+            self._running[job.digest] = job
+        return(True)
+
+    def _finish(self, job: Job, status: str, error=None, remember=True):
+        """Set the final status; remember=False for errors not due to the
+        file (e.g. the commit failed), which is retried at the next scan."""
+        job.status, job.error, job.finished = status, error, time.time()
+        if status == DONE:
+            job.progress = 1.0
+        with self._lock:
+            if status == FAILED and remember:
+                self._failed[job.file_path] = job.stamp
+                if job.digest is not None:
+                    self._failed_digests.add(job.digest)
+            self._finished.append(job.id)
+            while len(self._finished) > MAX_FINISHED:
+                self.jobs.pop(self._finished.popleft(), None)
+
+    def _run(self, job: Job):
+        job.status, job.started = RUNNING, time.time()
+        import src.activity as activity
+        try:
+            if not self._start(job):
+                self._finish(job, DONE)
+                return
+            session = activity.Activity()
+            session.define_source_file(job.file_path)
+            session.digest = job.digest
+            session.create_from_file()
+            session.remove_empty_points()
+            job.progress = 0.5
+        except Exception as e:
+            logging.error('Job ' + job.id + ' failed: ' + repr(e))
+            self._finish(job, FAILED, repr(e))
+            return
+        with self._lock:
+            self._parsed.append((job, session))
+        self._commit()
+
+    def _commit(self):
+        """Add all the parsed sessions waiting, in a single commit.
+
+        Sessions parsed while another worker commits wait for db_lock and
+        are then added together, so a burst of files makes a few versions
+        of the store, not one per file, and db_lock is held briefly.
+        """
+        with self.db_lock:
+            with self._lock:
+                batch, self._parsed = self._parsed, []
+            if not batch:
+                # committed by another worker meanwhile
+                return
+            db = self.get_db()
+            try:
+                self._add(db, batch)
+                errors = [None] * len(batch)
+            except Exception as e:
+                # find the sessions at fault: writing() dropped the changes
+                logging.error('Commit of {} jobs failed, retrying one by '
+                              'one: {}'.format(len(batch), repr(e)))
+                errors = []
+                for item in batch:
+                    try:
+                        self._add(db, [item])
+                        errors.append(None)
+                    except Exception as e:
+                        errors.append(repr(e))
+        # when all fail, the cause is not the files (e.g. disk full): they
+        # are retried at the next scan
+        remember = None in errors
+        for (job, _), error in zip(batch, errors):
+            if error is None:
+                self._finish(job, DONE)
+            else:
+                logging.error('Job ' + job.id + ' failed: ' + error)
+                self._finish(job, FAILED, error, remember=remember)
+
+    def _add(self, db, batch: list):
+        with db.writing():
+            db.add_activities([session for job, session in batch
+                               if not db.check_activity_in_database(
+                                   file_name=job.file_name)])
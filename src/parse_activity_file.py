@@ -15,12 +15,17 @@ https://github.com/polyvertex/fitdecode
 https://github.com/bunburya/fitness_tracker_data_parsing/blob/main/parse_fit.py
 """
 
-import src.parse_fit as parse_fit
-import src.parse_tcx as parse_tcx
-import src.parse_gpx as parse_gpx
-import pandas as pd
-from pathlib import Path
+import io
+import os
+import bz2
 import gzip
+import zipfile
+import collections
+import hashlib
+import importlib
+import threading
+import contextlib
+from pathlib import Path
 
 POINTS_COLUMNS = ['latitude',
                        'longitude',
@@ -50,38 +55,248 @@ ACTIVITY_COLUMNS = ['sport',
                          'activity_id',
                          ]
 
+# Only used to pick candidate files when walking folders; the format itself
+# is detected from the content.
+SUPPORTED_EXTENSIONS = ('.fit', '.tcx', '.gpx',
+                        '.fit.gz', '.tcx.gz', '.gpx.gz',
+                        '.fit.bz2', '.tcx.bz2', '.gpx.bz2',
+                        '.fit.zst', '.tcx.zst', '.gpx.zst',
+                        '.zip')
+
+# format -> module with a `create_dfs` function, imported on first use so
+# that fitdecode, lxml, gpxpy and dateutil are loaded only when needed
+PARSERS = {'fit': 'src.parse_fit',
+           'tcx': 'src.parse_tcx',
+           'gpx': 'src.parse_gpx'}
+
+def register_parser(file_format: str, module_name: str):
+    """Add or replace the module parsing a format."""
+    PARSERS[file_format] = module_name
+
+def get_parser(file_format: str):
+    """Return the parser module of a format, importing it if needed."""
+    try:
+        module_name = PARSERS[file_format]
+    except KeyError:
+        raise ValueError('No parser for format: ' + file_format)
+    return(importlib.import_module(module_name))
+
+ZIP_MAGIC = b'PK\x03\x04'
+
 def get_extension(file_path) -> str:
     suffixes = Path(file_path).suffixes
     return(''.join(suffixes))
 
+def is_candidate(file_name, archives=True) -> bool:
+    """Tell if the name ends with a supported extension, in any case.
+
+    Other dots in the name (e.g. `run.2014.04.fit`) do not matter.
+
+    Args:
+        archives: accept .zip archives.
+    """
+    name = str(file_name).lower()
+    return(name.endswith(SUPPORTED_EXTENSIONS) and
+           (archives or not name.endswith('.zip')))
+
+# bytes looked at to detect the compression and the format
+PEEK_SIZE = 2048
+
+class _Replay(io.RawIOBase):
+    """Raw stream giving back bytes already read, then the rest."""
+
+    def __init__(self, head: bytes, stream):
+        self._head = head
+        self._stream = stream
+
+    def readable(self):
+        return(True)
+
+    def readinto(self, buffer):
+        if self._head:
+            data, self._head = self._head[:len(buffer)], \
+                self._head[len(buffer):]
+        else:
+            data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return(len(data))
+
+def _peek(stream, n=PEEK_SIZE) -> bytes:
+    return(stream.peek(n)[:n])
+
+def _buffered(stream):
+    """Return a stream whose `peek` gives the first PEEK_SIZE bytes.
+
+    The `peek` of other streams may return less (512 bytes for a zip member,
+    one block for a decompressor), so the head is read in full first.
+    """
+    chunks, size = [], 0
+    while size < PEEK_SIZE:
+        chunk = stream.read(PEEK_SIZE - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    head = b''.join(chunks)
+    return(io.BufferedReader(_Replay(head, stream),
+                             buffer_size=max(PEEK_SIZE,
+                                             io.DEFAULT_BUFFER_SIZE)))
+
+def _decompress(stream):
+    """Return a decompressing stream if the content is compressed."""
+    magic = _peek(stream, 4)
+    if magic.startswith(b'\x1f\x8b'):
+        return(gzip.GzipFile(fileobj=stream, mode='rb'))
+    if magic.startswith(b'BZh'):
+        return(bz2.BZ2File(stream, mode='rb'))
+    if magic.startswith(b'\x28\xb5\x2f\xfd'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstandard is required to read .zst files')
+        reader = zstandard.ZstdDecompressor().stream_reader(stream)
+        return(io.BufferedReader(reader))
+    return(stream)
+
+def detect_format(stream) -> str:
+    """Return the format of an uncompressed stream, from its first bytes.
+
+    The stream is one returned by `_buffered`.
+    """
+    head = _peek(stream)
+    if len(head) >= 12 and head[8:12] == b'.FIT':
+        return('fit')
+    head = head.lower()
+    if b'<trainingcenterdatabase' in head:
+        return('tcx')
+    if b'<gpx' in head:
+        return('gpx')
+    raise ValueError('Unknown activity file format')
+
+# last archive opened by each thread (or process of parse_many), reused
+# for its next members instead of reading the central directory again
+_archives = threading.local()
+
+def _open_archive(zip_path) -> zipfile.ZipFile:
+    """Return the archive, opened once per thread while it is unchanged."""
+    stat = os.stat(zip_path)
+    stamp = (str(zip_path), stat.st_mtime_ns, stat.st_size)
+    cached = getattr(_archives, 'last', None)
+    if cached is None or cached[0] != stamp:
+        close_archive()
+        cached = (stamp, zipfile.ZipFile(zip_path))
+        _archives.last = cached
+    return(cached[1])
+
+def close_archive():
+    """Close the archive kept open by the current thread, if any."""
+    cached = getattr(_archives, 'last', None)
+    if cached is not None:
+        cached[1].close()
+        _archives.last = None
+
+def _split_zip_path(file_path):
+    """Split `export.zip/activities/1.fit` in the archive and member names.
+
+    Returns None if the path does not point inside a zip archive.
+    """
+    path = Path(file_path)
+    cached = getattr(_archives, 'last', None)
+    if cached is not None:
+        archive = Path(cached[0][0])
+        if archive in path.parents:
+            return(archive, path.relative_to(archive).as_posix())
+    if path.exists():
+        return(None)
+    for parent in path.parents:
+        if parent.is_file() and zipfile.is_zipfile(parent):
+            return(parent, path.relative_to(parent).as_posix())
+    return(None)
+
+@contextlib.contextmanager
+def open_source(file_path):
+    """Open a file, or a member inside a zip archive, as a binary stream."""
+    zip_path = _split_zip_path(file_path)
+    if zip_path is None:
+        with open(file_path, 'rb') as file_obj:
+            yield(file_obj)
+    else:
+        archive = _open_archive(zip_path[0])
+        with archive.open(zip_path[1]) as file_obj:
+            yield(file_obj)
+
+def file_digest(file_path, chunk_size=1 << 20) -> str:
+    """Return the sha1 of the file content, read in chunks."""
+    digest = hashlib.sha1()
+    with open_source(file_path) as file_obj:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+            digest.update(chunk)
+    return(digest.hexdigest())
+
+def list_sources(file_path) -> list:
+    """Return the paths to parse for a file.
+
+    A zip archive is expanded in the paths of its supported members (e.g.
+    `export.zip/activities/1.fit.gz`), which `parse_file` reads directly
+    out of the archive without extracting them.
+    """
+    with open(file_path, 'rb') as file_obj:
+        if file_obj.read(4) != ZIP_MAGIC:
+            return([str(file_path)])
+    with zipfile.ZipFile(file_path) as archive:
+        return([os.path.join(str(file_path), info.filename)
+                for info in archive.infolist()
+                if not info.is_dir() and
+                is_candidate(info.filename, archives=False)])
+
+def parse_stream(file_obj):
+    """Parse a binary stream, possibly compressed, of any supported format."""
+    stream = _buffered(_decompress(_buffered(file_obj)))
+    parser = get_parser(detect_format(stream))
+    return(parser.create_dfs(stream,
+                             ACTIVITY_COLUMNS,
+                             POINTS_COLUMNS,
+                             LAPS_COLUMNS))
+
 def parse_file(file_path):
-    laps = pd.DataFrame()
-    points = pd.DataFrame()
-    if get_extension(file_path) == '.fit':
-        activity, laps, points = parse_fit.create_dfs(file_path,
-                                                      ACTIVITY_COLUMNS,
-                                                      POINTS_COLUMNS,
-                                                      LAPS_COLUMNS)
-    elif get_extension(file_path) == '.fit.gz':
-        with gzip.open(file_path,'r') as file_obj:
-            activity, laps, points = parse_fit.create_dfs(file_obj,
-                                                      ACTIVITY_COLUMNS,
-                                                      POINTS_COLUMNS,
-                                                      LAPS_COLUMNS)
-    elif get_extension(file_path) == '.tcx.gz':
-        with gzip.open(file_path,'r') as file_obj:
-            activity, laps, points = parse_tcx.create_dfs(file_obj,
-                                                          ACTIVITY_COLUMNS,
-                                                          POINTS_COLUMNS,
-                                                          LAPS_COLUMNS)
-    elif get_extension(file_path) == '.gpx.gz':
-        with gzip.open(file_path,'r') as file_obj:
-            activity, laps, points = parse_gpx.create_dfs(file_obj,
-                                                          ACTIVITY_COLUMNS,
-                                                          POINTS_COLUMNS,
-                                                          LAPS_COLUMNS)
+    with open_source(file_path) as file_obj:
+        activity, laps, points = parse_stream(file_obj)
     return(activity, laps, points)
 
+def _parse_safe(file_path):
+    try:
+        return(file_path, parse_file(file_path), None)
+    except Exception as e:
+        return(file_path, None, repr(e))
+
+def parse_many(file_paths, workers=None, window=4):
+    """Parse the files in a pool of processes.
+
+    Args:
+        file_paths: paths as returned by `list_sources`.
+        workers: number of processes (default: cpu count).
+        window: files parsed ahead per process; bounds the frames waiting
+            in memory while the caller is busy (e.g. saving).
+
+    Yields:
+        Tuples (file_path, (activity, laps, points), error), in order; one
+        of the frames and the error is None.
+
+    Members of an archive should be consecutive, as `list_sources` returns
+    them, so that the processes find the archive still open.
+    """
+    # multiprocessing is only needed by the bulk importer
+    from concurrent.futures import ProcessPoolExecutor
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        limit = (workers or os.cpu_count() or 1) * window
+        for file_path in file_paths:
+            pending.append(pool.submit(_parse_safe, file_path))
+            if len(pending) >= limit:
+                yield(pending.popleft().result())
+        while pending:
+            yield(pending.popleft().result())
+
 # folder_name = 'C:\\dev\\techjournal\\data'
 # file_name = 'Move_2014_04_04_18_20_11_Running.fit'
 # file_name = '911320533.tcx.gz'
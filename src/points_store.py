@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Read-only, memory-mapped copy of the points and laps dataframes.
+
+Each column is saved as a `.npy` file, with the rows sorted by activity, and
+an offset table gives the rows of every activity. Readers open the files
+with `numpy.load(mmap_mode='r')`: several worker processes serving the app
+share the same page-cache pages, slicing an activity does not copy, and
+opening the store does not deserialize anything.
+
+The files are written in the `store` subfolder of every version of the
+pickles (see src.store), and readers follow the current version.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import src.store as store
+
+POINTS_COLUMNS = ['latitude', 'longitude', 'lap', 'altitude', 'timestamp',
+                  'heart_rate', 'cadence', 'speed']
+LAPS_COLUMNS = ['start_time', 'total_distance', 'total_elapsed_time',
+                'max_speed', 'max_heart_rate', 'avg_heart_rate']
+TIME_COLUMNS = ['timestamp', 'start_time']
+
+
+def _to_array(column: pd.Series, name: str) -> np.ndarray:
+    if name in TIME_COLUMNS:
+        # datetimes as int64 nanoseconds since epoch, NaT as int64 min
+        times = pd.to_datetime(column, utc=True)
+        return(times.dt.tz_localize(None).values.astype('datetime64[ns]')
+               .astype(np.int64))
+    return(pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64))
+
+
+def _save(folder: Path, name: str, array: np.ndarray):
+    np.save(folder / (name + '.npy'), array)
+
+
+def _write_table(folder: Path, prefix: str, df: pd.DataFrame, columns: list):
+    if df.empty or 'activity_id' not in df:
+        df = pd.DataFrame(columns=columns + ['activity_id'])
+    df = df.sort_values('activity_id', kind='mergesort')
+    ids = df['activity_id'].to_numpy(dtype=np.int64)
+    activity_ids, starts = np.unique(ids, return_index=True)
+    offsets = np.append(starts, len(ids)).astype(np.int64)
+    for column in columns:
+        if column in df:
+            _save(folder, prefix + '_' + column, _to_array(df[column], column))
+    _save(folder, prefix + '_ids', activity_ids)
+    _save(folder, prefix + '_offsets', offsets)
+
+
+def write(points: pd.DataFrame, laps: pd.DataFrame, folder):
+    """Write the points and laps columns to the store folder."""
+    logging.info('Writing points store')
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    _write_table(folder, 'laps', laps, LAPS_COLUMNS)
+    _write_table(folder, 'points', points, POINTS_COLUMNS)
+
+
+class _Table():
+    def __init__(self, folder: Path, prefix: str, columns: list):
+        self.ids = np.load(folder / (prefix + '_ids.npy'), mmap_mode='r')
+        self.offsets = np.load(folder / (prefix + '_offsets.npy'),
+                               mmap_mode='r')
+        self.columns = {}
+        for column in columns:
+            path = folder / (prefix + '_' + column + '.npy')
+            if path.exists():
+                self.columns[column] = np.load(path, mmap_mode='r')
+
+    def get(self, activity_id) -> dict:
+        """Return the column slices (views, not copies) of an activity."""
+        position = np.searchsorted(self.ids, activity_id)
+        if position == len(self.ids) or self.ids[position] != activity_id:
+            return({name: values[:0]
+                    for name, values in self.columns.items()})
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return({name: values[start:end]
+                for name, values in self.columns.items()})
+
+    def get_frame(self, activity_id) -> pd.DataFrame:
+        columns = self.get(activity_id)
+        df = pd.DataFrame(columns, copy=False)
+        for name in TIME_COLUMNS:
+            if name in df:
+                df[name] = pd.to_datetime(df[name], utc=True)
+        return(df.assign(activity_id=activity_id))
+
+
+def exists(root=store.STORE_ROOT) -> bool:
+    """Return True if the current version of the pickles has the files."""
+    folder = store.current_folder(root)/'store'
+    return((folder/'points_offsets.npy').exists())
+
+
+class PointsStore():
+    def __init__(self, root=store.STORE_ROOT, folder=None):
+        """Open the points store.
+
+        Args:
+            root: root of the versioned pickles, see src.store.
+            folder: version folder to open and keep, never refreshed, so
+                that the points match tables read from the same folder;
+                by default the current version is opened and followed.
+        """
+        self.root = Path(root)
+        # folder of the version of the pickles opened
+        self.folder = None
+        self.version = None
+        self.points = None
+        self.laps = None
+        self.pinned = folder is not None
+        if self.pinned:
+            self._open(Path(folder), None)
+        else:
+            self.refresh()
+
+    def _open(self, folder: Path, version):
+        self.points = _Table(folder/'store', 'points', POINTS_COLUMNS)
+        self.laps = _Table(folder/'store', 'laps', LAPS_COLUMNS)
+        self.folder, self.version = folder, version
+
+    def refresh(self):
+        """Reopen the files if a new version was committed."""
+        if self.pinned:
+            return
+        manifest = store.read_manifest(self.root)
+        if manifest['version'] != self.version:
+            logging.info('Opening points store, version ' +
+                         str(manifest['version']))
+            self._open(store.get_folder(manifest, self.root),
+                       manifest['version'])
+
+    def get_points(self, activity_id) -> pd.DataFrame:
+        self.refresh()
+        return(self.points.get_frame(activity_id))
+
+    def get_laps(self, activity_id) -> pd.DataFrame:
+        self.refresh()
+        return(self.laps.get_frame(activity_id))
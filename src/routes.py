@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Search of activities along the same route.
+
+Each track is turned into the set of grid cells (~200m) it crosses, and
+the set is summarized by a MinHash signature: the share of equal values in
+two signatures estimates the Jaccard similarity of the two sets. Signatures
+are split in bands and every band is hashed in a bucket (locality-sensitive
+hashing), so the candidates for a query are only the activities sharing at
+least one bucket, instead of all of them.
+"""
+
+import numpy as np
+import pandas as pd
+
+NUM_PERM = 64
+BANDS = 16
+CELL_SIZE = 0.002
+
+_rng = np.random.RandomState(20220301)
+_A = _rng.randint(1, 2**62, size=NUM_PERM, dtype=np.int64).astype(
+    np.uint64) | np.uint64(1)
+_B = _rng.randint(0, 2**62, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+
+
+# signature of a track without any position (indoor, treadmill)
+EMPTY = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+
+
+def track_cells(points: pd.DataFrame, cell_size=CELL_SIZE) -> np.ndarray:
+    """Return the keys of the grid cells crossed by the track."""
+    latitudes = points['latitude'].to_numpy(dtype=float)
+    longitudes = points['longitude'].to_numpy(dtype=float)
+    valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+    rows = np.floor(latitudes[valid] / cell_size).astype(np.int64)
+    columns = np.floor(longitudes[valid] / cell_size).astype(np.int64)
+    return(np.unique((rows << 32) ^ (columns & 0xFFFFFFFF)))
+
+
+def signature(cells: np.ndarray) -> np.ndarray:
+    """Return the MinHash signature of a set of cell keys."""
+    if cells.size == 0:
+        return(EMPTY.copy())
+    keys = cells.astype(np.uint64)
+    # multiply-add hashing, wrapping modulo 2**64
+    hashes = _A[:, None] * keys[None, :] + _B[:, None]
+    return((hashes >> np.uint64(16)).min(axis=1))
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimate the Jaccard similarity of two signatures."""
+    return(float(np.mean(first == second)))
+
+
+class RouteIndex():
+    def __init__(self, bands=BANDS):
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.signatures = {}
+        self.buckets = {}
+
+    @classmethod
+    def from_signatures(cls, routes: pd.DataFrame, **kwargs):
+        index = cls(**kwargs)
+        for activity_id, value in zip(routes['activity_id'],
+                                      routes['signature']):
+            index.add(activity_id, value)
+        return(index)
+
+    def _keys(self, value: np.ndarray):
+        for band in range(self.bands):
+            yield((band, value[band * self.rows:(band + 1) * self.rows]
+                   .tobytes()))
+
+    def add(self, activity_id, value: np.ndarray):
+        """Index a signature; tracks without positions are not indexed,
+        they would all share the same buckets."""
+        if np.array_equal(value, EMPTY):
+            return
+        self.signatures[activity_id] = value
+        for key in self._keys(value):
+            self.buckets.setdefault(key, set()).add(activity_id)
+
+    def remove(self, activity_id):
+        value = self.signatures.pop(activity_id, None)
+        if value is not None:
+            for key in self._keys(value):
+                self.buckets[key].discard(activity_id)
+
+    def query(self, activity_id, n=5, threshold=0.5) -> list:
+        """Return up to n (activity_id, similarity) along the same route."""
+        value = self.signatures.get(activity_id)
+        if value is None:
+            return([])
+        candidates = set()
+        for key in self._keys(value):
+            candidates |= self.buckets.get(key, set())
+        candidates.discard(activity_id)
+        found = [(other, similarity(value, self.signatures[other]))
+                 for other in candidates]
+        found = [item for item in found if item[1] >= threshold]
+        return(sorted(found, key=lambda item: -item[1])[:n])
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Matching of route segments (e.g. a favourite climb) across activities.
+
+A segment is defined by a start and an end position and a radius. An effort
+is a pass within the radius of the start followed, later in the same
+activity, by a pass within the radius of the end: going the other way does
+not count.
+
+Only the activities passing near both ends are compared, found with a grid
+index of the cells each activity crosses; distances are then computed on
+all the points of a candidate at once with numpy.
+"""
+
+import itertools
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 6371000.0
+
+SEGMENT_COLUMNS = ['segment_id', 'name', 'start_latitude', 'start_longitude',
+                   'end_latitude', 'end_longitude', 'radius']
+
+EFFORT_COLUMNS = ['segment_id', 'activity_id', 'start_time',
+                  'elapsed_time']
+
+
+def distance(latitudes, longitudes, latitude: float, longitude: float):
+    """Return the haversine distances in meters from one position."""
+    lat1, lon1 = np.radians(latitudes), np.radians(longitudes)
+    lat2, lon2 = np.radians(latitude), np.radians(longitude)
+    a = np.sin((lat2 - lat1) / 2)**2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return(2 * EARTH_RADIUS * np.arcsin(np.sqrt(a)))
+
+
+class GridIndex():
+    def __init__(self, cell_size=0.01):
+        """Create an empty index.
+
+        Args:
+            cell_size: side of the cells in degrees (0.01 is ~1km).
+        """
+        self.cell_size = cell_size
+        self.cells = {}
+        self._activity_cells = {}
+
+    @classmethod
+    def from_points(cls, points: pd.DataFrame, **kwargs):
+        index = cls(**kwargs)
+        if points.empty:
+            return(index)
+        for activity_id, activity_points in points.groupby('activity_id',
+                                                           sort=False):
+            index.add(activity_id, activity_points)
+        return(index)
+
+    def _cells(self, latitudes, longitudes) -> np.ndarray:
+        rows = np.floor(np.asarray(latitudes) / self.cell_size)
+        columns = np.floor(np.asarray(longitudes) / self.cell_size)
+        cells = np.stack([rows, columns], axis=1)
+        cells = cells[~np.isnan(cells).any(axis=1)]
+        return(np.unique(cells.astype(np.int64), axis=0))
+
+    def add(self, activity_id, points: pd.DataFrame):
+        cells = [tuple(cell) for cell in
+                 self._cells(points['latitude'], points['longitude'])]
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(activity_id)
+        self._activity_cells[activity_id] = cells
+
+    def remove(self, activity_id):
+        for cell in self._activity_cells.pop(activity_id, []):
+            self.cells[cell].discard(activity_id)
+
+    def candidates(self, latitude: float, longitude: float,
+                   radius: float) -> set:
+        """Return the activities crossing a cell within radius meters."""
+        span = int(np.ceil(radius / (EARTH_RADIUS * np.radians(
+            self.cell_size) * max(np.cos(np.radians(latitude)), 0.01))))
+        row, column = self._cells([latitude], [longitude])[0]
+        found = set()
+        for i, j in itertools.product(range(-span, span + 1), repeat=2):
+            found |= self.cells.get((row + i, column + j), set())
+        return(found)
+
+
+def _passes(near: np.ndarray):
+    """Return the first and last index of every run of True values."""
+    starts = np.flatnonzero(near & ~np.concatenate([[False], near[:-1]]))
+    ends = np.flatnonzero(near & ~np.concatenate([near[1:], [False]]))
+    return(zip(starts, ends))
+
+
+def match_efforts(segment, activity_id, points: pd.DataFrame) -> list:
+    """Return the efforts of an activity on a segment, as dicts."""
+    if points.empty:
+        return([])
+    latitudes = points['latitude'].to_numpy(dtype=float)
+    longitudes = points['longitude'].to_numpy(dtype=float)
+    to_start = distance(latitudes, longitudes,
+                        segment['start_latitude'], segment['start_longitude'])
+    to_end = distance(latitudes, longitudes,
+                      segment['end_latitude'], segment['end_longitude'])
+    near_end = np.flatnonzero(to_end <= segment['radius'])
+    if near_end.size == 0:
+        return([])
+    timestamps = pd.to_datetime(points['timestamp'], utc=True).reset_index(
+        drop=True)
+    efforts, last_end = [], -1
+    for start, run_end in _passes(to_start <= segment['radius']):
+        if start <= last_end:
+            continue
+        # within the pass, start from the point closest to the segment start
+        start = start + int(np.argmin(to_start[start:run_end + 1]))
+        following = near_end[near_end > run_end]
+        if following.size == 0:
+            break
+        end = int(following[0])
+        elapsed = (timestamps[end] - timestamps[start]).total_seconds()
+        if not np.isnan(elapsed):
+            efforts.append({'segment_id': segment['segment_id'],
+                            'activity_id': activity_id,
+                            'start_time': timestamps[start],
+                            'elapsed_time': elapsed})
+        last_end = end
+    return(efforts)
+
+
+def match_segment(segment, points: pd.DataFrame,
+                  index: GridIndex) -> pd.DataFrame:
+    """Return the efforts on a segment across all the activities."""
+    candidates = index.candidates(segment['start_latitude'],
+                                  segment['start_longitude'],
+                                  segment['radius']) & \
+        index.candidates(segment['end_latitude'],
+                         segment['end_longitude'],
+                         segment['radius'])
+    efforts = []
+    if candidates:
+        candidate_points = points[points['activity_id'].isin(candidates)]
+        for activity_id, activity_points in candidate_points.groupby(
+                'activity_id', sort=False):
+            efforts += match_efforts(segment, activity_id, activity_points)
+    return(pd.DataFrame(efforts, columns=EFFORT_COLUMNS))
+
+
+def match_activity(segments: pd.DataFrame, activity_id,
+                   points: pd.DataFrame) -> pd.DataFrame:
+    """Return the efforts of a new activity on all the segments."""
+    efforts = []
+    if not segments.empty and not points.empty:
+        index = GridIndex()
+        index.add(activity_id, points)
+        for _, segment in segments.iterrows():
+            if index.candidates(segment['start_latitude'],
+                                segment['start_longitude'],
+                                segment['radius']) and \
+                    index.candidates(segment['end_latitude'],
+                                     segment['end_longitude'],
+                                     segment['radius']):
+                efforts += match_efforts(segment, activity_id, points)
+    return(pd.DataFrame(efforts, columns=EFFORT_COLUMNS))
+
+
+def leaderboard(efforts: pd.DataFrame, segment_id: int, n=10) -> pd.DataFrame:
+    """Return the n fastest efforts on a segment."""
+    efforts = efforts[efforts['segment_id'] == segment_id]
+    return(efforts.sort_values('elapsed_time').head(n))
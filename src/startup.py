@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Measure the start-up time of the entry points.
+
+Every module is imported in a fresh interpreter, several times, and the
+median wall time is reported together with the heavy third-party packages
+the import pulled in.
+
+Usage:
+    python -m src.startup main src.importer src.export --runs 5
+"""
+
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HEAVY = ['pandas', 'numpy', 'folium', 'fitdecode', 'lxml', 'gpxpy',
+         'dateutil', 'flask']
+
+_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {heavy} if m in sys.modules]]))
+'''
+
+
+def measure(module: str, runs=5) -> tuple:
+    """Return the median import time in seconds and the heavy packages."""
+    times, loaded = [], []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c',
+                                 _PROBE.format(module=module, heavy=HEAVY)],
+                                capture_output=True, text=True, check=True)
+        elapsed, loaded = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(elapsed)
+    return(statistics.median(times), loaded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure import times.')
+    parser.add_argument('modules', nargs='+', help='e.g. main src.importer')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+    for module in args.modules:
+        try:
+            elapsed, loaded = measure(module, args.runs)
+        except subprocess.CalledProcessError as e:
+            print('{:<24} failed: {}'.format(module,
+                                             e.stderr.strip().splitlines()[-1]))
+            continue
+        print('{:<24} {:8.1f} ms  {}'.format(module, elapsed * 1000,
+                                             ', '.join(loaded)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
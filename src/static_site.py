@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Static HTML build of the journal, for a read-only mirror.
+
+The pages are rendered from the same templates as the Flask app: the home
+page, the activities index and one page per activity with its map. The
+activity pages are rendered in a pool of processes, each reading the
+points from the memory-mapped store; a page is rebuilt only when the
+digest of its content (activity row, points, similar routes) changed since
+the last build, so a nightly rebuild only renders the new activities.
+
+The tables and the points are all read from the same version of the store,
+even if a new version is committed during the build.
+
+Usage:
+    python -m src.static_site C:\\dev\\techjournal\\site --workers 4
+"""
+
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+import jinja2
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import src.activity as activity
+import src.helpers as helpers
+import src.points_store as points_store
+import src.routes as routes
+import src.store as store
+import configs.config as config
+
+TEMPLATES = Path('templates')
+STATIC = Path('static')
+DIGESTS = '.digests.json'
+
+_store = None
+
+
+def url_for(endpoint: str, filename=None) -> str:
+    """Relative links in place of the Flask routes."""
+    if endpoint == 'static':
+        return('static/' + filename)
+    return({'index': 'index.html',
+            'activities_index': 'activities.html'}[endpoint])
+
+
+def get_environment(map_html=None) -> jinja2.Environment:
+    loaders = [jinja2.FileSystemLoader(str(TEMPLATES))]
+    if map_html is not None:
+        loaders.insert(0, jinja2.DictLoader({'map.html': map_html}))
+    environment = jinja2.Environment(loader=jinja2.ChoiceLoader(loaders),
+                                     autoescape=True)
+    environment.globals['url_for'] = url_for
+    return(environment)
+
+
+def activity_digest(row: dict, columns: dict, similar: list) -> str:
+    """Return the digest of everything shown on an activity page."""
+    digest = hashlib.sha1()
+    digest.update(json.dumps(row, sort_keys=True, default=str).encode())
+    for name in sorted(columns):
+        digest.update(name.encode())
+        digest.update(columns[name].tobytes())
+    digest.update(json.dumps(similar, default=str).encode())
+    return(digest.hexdigest())
+
+
+def _open_store(folder: str):
+    global _store
+    _store = points_store.PointsStore(folder=folder)
+
+
+def _render_activity(output: str, activity_id, similar: list):
+    """Write the page of an activity; run in a worker process."""
+    import src.render_track as track
+    points = _store.points.get_frame(activity_id)
+    activity_map = track.create_map_with_track(points)
+    environment = get_environment(activity_map.get_root().render())
+    similar = [(str(other) + '.html', round(score, 2))
+               for other, score in similar]
+    html = environment.get_template('activity.html').render(
+        map_template='map.html', similar=similar)
+    (Path(output)/(str(activity_id) + '.html')).write_text(html,
+                                                          encoding='utf-8')
+    return(activity_id)
+
+
+def _read_tables(folder: Path) -> dict:
+    """Read the tables of the site and open the points store of a version.
+
+    Opening the points store in the same read pins it to the folder of the
+    tables: a version removed meanwhile is retried as a whole.
+    """
+    tables = {}
+    for which in ('activities', 'routes'):
+        table = activity._read_pickle(folder/activity.PICKLES[which], which)
+        tables[which] = activity._empty_table(which) if table is None \
+            else table
+    tables['points'] = points_store.PointsStore(folder=folder)
+    return(tables)
+
+
+def build(output: str, workers=None, force=False) -> int:
+    """Render the site in the output folder.
+
+    Args:
+        output: destination folder.
+        workers: number of rendering processes (default: cpu count).
+        force: rebuild all the pages, ignoring the digests.
+
+    Returns:
+        The number of activity pages rendered.
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    shutil.copytree(STATIC, output/'static', dirs_exist_ok=True)
+    manifest, tables = activity.read_snapshot(_read_tables)
+    folder = store.get_folder(manifest)
+    activities = tables['activities'].copy()
+    environment = get_environment()
+    (output/'index.html').write_text(
+        environment.get_template('base.html').render(links=config.LINKS),
+        encoding='utf-8')
+    if activities.empty:
+        return(0)
+    activities['link'] = [str(i) + '.html' for i in activities['activity_id']]
+    table = activities[['link', 'sport', 'start_time', 'total_distance',
+                        'total_elapsed_time', 'source_file_name',
+                        'avg_latitude', 'avg_longitude']]
+    (output/'activities.html').write_text(
+        environment.get_template('activities_index.html').render(
+            table=table.to_html(render_links=True)),
+        encoding='utf-8')
+    try:
+        old_digests = json.loads((output/DIGESTS).read_text())
+    except FileNotFoundError:
+        old_digests = {}
+    route_index = routes.RouteIndex.from_signatures(tables['routes'])
+    digests, todo = {}, []
+    for row in activities.drop(columns='link').to_dict(orient='records'):
+        activity_id = row['activity_id']
+        similar = route_index.query(activity_id)
+        key = str(activity_id)
+        digests[key] = activity_digest(
+            row, tables['points'].points.get(activity_id), similar)
+        if force or old_digests.get(key) != digests[key] or \
+                not (output/(key + '.html')).exists():
+            todo.append((activity_id, similar))
+    logging.info('Rendering {} of {} activity pages'.format(len(todo),
+                                                            len(digests)))
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_open_store,
+                                 initargs=(str(folder),)) as pool:
+            list(pool.map(_render_activity, [str(output)] * len(todo),
+                          *zip(*todo)))
+    (output/DIGESTS).write_text(json.dumps(digests))
+    return(len(todo))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the static site.')
+    parser.add_argument('output', help='destination folder')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='rendering processes (default: cpu count)')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild all the pages')
+    args = parser.parse_args(argv)
+    helpers.configure_logging()
+    activity.ensure_points_store()
+    count = build(args.output, workers=args.workers, force=args.force)
+    print('{} activity pages rendered'.format(count))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Versioned, concurrency-safe layout of the pickles folder.
+
+Every commit writes all the tables in a new folder (`pickles/v000042`),
+renamed in place only when complete, then points `pickles/manifest.json`
+to it with an atomic rename. Readers follow the manifest and always get a
+consistent snapshot without taking any lock; the last few versions are
+kept so a reader still loading an older one is not disturbed.
+
+Writers take an inter-process lock, so only one commit runs at a time, and
+a commit based on an old version is refused (`ConflictError`) instead of
+silently dropping the changes of the other writer.
+
+Without a manifest (pickles written before versioning) the tables are read
+from the `pickles` folder itself; the first commit migrates them.
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+from pathlib import Path
+
+STORE_ROOT = Path('.')/'pickles'
+KEEP_VERSIONS = 3
+
+_thread_lock = threading.RLock()
+_lock_file = None
+_lock_depth = 0
+
+
+class ConflictError(Exception):
+    """The store was committed by another writer since it was loaded."""
+
+
+def read_manifest(root=STORE_ROOT) -> dict:
+    try:
+        with open(Path(root)/'manifest.json') as file_obj:
+            return(json.load(file_obj))
+    except FileNotFoundError:
+        return({'version': 0, 'folder': None})
+
+
+def get_folder(manifest: dict, root=STORE_ROOT) -> Path:
+    """Return the folder of the snapshot the manifest points to."""
+    if manifest['folder'] is None:
+        return(Path(root))
+    return(Path(root)/manifest['folder'])
+
+
+def current_folder(root=STORE_ROOT) -> Path:
+    return(get_folder(read_manifest(root), root))
+
+
+def _lock(file_obj):
+    if os.name == 'nt':
+        import msvcrt
+        while True:
+            try:
+                msvcrt.locking(file_obj.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after 10 seconds: keep waiting
+                continue
+    else:
+        import fcntl
+        fcntl.flock(file_obj.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock(file_obj):
+    if os.name == 'nt':
+        import msvcrt
+        file_obj.seek(0)
+        msvcrt.locking(file_obj.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file_obj.fileno(), fcntl.LOCK_UN)
+
+
+class WriteLock():
+    """Single-writer lock, across processes; reentrant in a thread."""
+
+    def __init__(self, root=STORE_ROOT):
+        self.path = Path(root)/'write.lock'
+
+    def __enter__(self):
+        global _lock_file, _lock_depth
+        _thread_lock.acquire()
+        if _lock_depth == 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _lock_file = open(self.path, 'a+b')
+            _lock(_lock_file)
+        _lock_depth += 1
+        return(self)
+
+    def __exit__(self, *exc):
+        global _lock_file, _lock_depth
+        _lock_depth -= 1
+        if _lock_depth == 0:
+            _unlock(_lock_file)
+            _lock_file.close()
+            _lock_file = None
+        _thread_lock.release()
+
+
+def commit(write, expected_version=None, root=STORE_ROOT) -> int:
+    """Write a new version of the store and make it current.
+
+    Args:
+        write: function writing all the tables in the folder it receives.
+        expected_version: version the changes are based on; None to skip
+            the check.
+
+    Returns:
+        The new version number.
+    """
+    root = Path(root)
+    with WriteLock(root):
+        manifest = read_manifest(root)
+        if expected_version is not None and \
+                manifest['version'] != expected_version:
+            raise ConflictError('store is at version {}, changes are based '
+                                'on version {}'.format(manifest['version'],
+                                                       expected_version))
+        version = manifest['version'] + 1
+        name = 'v{:06d}'.format(version)
+        tmp = root/(name + '.tmp')
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        write(tmp)
+        os.replace(tmp, root/name)
+        manifest_tmp = root/'manifest.json.tmp'
+        with open(manifest_tmp, 'w') as file_obj:
+            json.dump({'version': version, 'folder': name}, file_obj)
+            file_obj.flush()
+            os.fsync(file_obj.fileno())
+        os.replace(manifest_tmp, root/'manifest.json')
+        logging.info('Store committed, version ' + str(version))
+        _remove_old_versions(root, version)
+    return(version)
+
+
+def _remove_old_versions(root: Path, version: int):
+    for folder in root.glob('v[0-9]*'):
+        try:
+            old = int(folder.name[1:])
+        except ValueError:
+            continue
+        if old <= version - KEEP_VERSIONS:
+            try:
+                shutil.rmtree(folder)
+            except OSError:
+                # still memory-mapped by a reader (Windows): retry next time
+                logging.info('Cannot remove ' + folder.name)
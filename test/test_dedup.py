@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Duplicate detection between recordings of the same workout at different
+point densities, as a FIT from the watch and a GPX from the sync service,
+and choice of the record kept.
+
+Run from the repository root: python -m pytest test/test_dedup.py
+"""
+
+from pathlib import Path
+import pytest
+import pandas as pd
+import src.dedup as dedup
+import src.activity as activity
+import src.parse_activity_file as parse_activity_file
+
+FIT_FILE = Path(__file__).parent/'Move_2014_04_04_18_20_11_Running.fit'
+
+
+@pytest.fixture(scope='module')
+def points():
+    activity, laps, points = parse_activity_file.parse_file(FIT_FILE)
+    return(points[points['latitude'] > 0].assign(activity_id=1))
+
+
+@pytest.mark.parametrize('step', [2, 3, 5])
+def test_resampled_track_is_duplicate(points, step):
+    index = dedup.DuplicateIndex.from_points(points)
+    assert index.find(points.iloc[::step]) == 1
+
+
+def test_shifted_track_is_not_duplicate(points):
+    index = dedup.DuplicateIndex.from_points(points)
+    moved = points.assign(latitude=points['latitude'] + 0.1)
+    assert index.find(moved) is None
+
+
+def fit_session():
+    session = activity.Activity()
+    session.define_source_file(str(FIT_FILE))
+    session.create_from_file()
+    session.remove_empty_points()
+    return(session)
+
+
+def gpx_session():
+    """The same workout as exported by the sync service: more points, but
+    no laps, start time or sport, as parse_gpx returns it."""
+    frames, laps, points = parse_activity_file.parse_file(FIT_FILE)
+    frames = frames.assign(start_time=None, sport=None, total_distance=None)
+    points = pd.concat([points, points], ignore_index=True)
+    session = activity.Activity()
+    session.define_source_file('sync/run.gpx')
+    session.create_from_frames(frames, laps.iloc[:0], points,
+                               digest='f' * 40)
+    session.remove_empty_points()
+    return(session)
+
+
+@pytest.mark.parametrize('batch', [False, True])
+@pytest.mark.parametrize('order', [('fit', 'gpx'), ('gpx', 'fit')])
+def test_watch_record_kept_over_sync_copy(tmp_path, monkeypatch, order,
+                                         batch):
+    monkeypatch.chdir(tmp_path)
+    db = activity.Activities()
+    sessions = [{'fit': fit_session, 'gpx': gpx_session}[name]()
+                for name in order]
+    if batch:
+        db.add_activities(sessions)
+    else:
+        for session in sessions:
+            db.add_activity(session)
+    assert db.activities['source_file_name'].tolist() == [FIT_FILE.name]
+    assert db.duplicates['source_file_name'].tolist() == ['run.gpx']
+    assert set(db.points['activity_id']) == set(db.activities['activity_id'])
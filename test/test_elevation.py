@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Altitudes interpolated from synthetic SRTM tiles.
+
+Run from the repository root: python -m pytest test/test_elevation.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import src.elevation as elevation
+
+
+@pytest.fixture
+def dem(tmp_path):
+    """A 3x3 tile of N45E008 on the plane 200 * dx + 100 * dy, north row
+    first, and a tile of N46E008 with a void in its north-east corner."""
+    rows, columns = np.mgrid[0:3, 0:3]
+    plane = (100 * columns + 50 * (2 - rows)).astype('>i2')
+    plane.tofile(str(tmp_path/'N45E008.hgt'))
+    void = np.full((3, 3), 1000, dtype='>i2')
+    void[0, 2] = elevation.VOID
+    void.tofile(str(tmp_path/'N46E008.hgt'))
+    return(elevation.TileCache(tmp_path))
+
+
+def test_tile_name():
+    assert elevation.tile_name(45, 8) == 'N45E008.hgt'
+    assert elevation.tile_name(-1, -72) == 'S01W072.hgt'
+
+
+@pytest.mark.parametrize('latitude, longitude, height', [
+    (45.0, 8.0, 0.0),
+    (45.5, 8.5, 150.0),
+    (45.25, 8.75, 175.0),
+    (45.9, 8.1, 110.0)])
+def test_bilinear(dem, latitude, longitude, height):
+    assert dem.sample([latitude], [longitude])[0] == pytest.approx(height)
+
+
+def test_unknown_heights(dem):
+    heights = dem.sample([46.2, 46.9, 47.5, np.nan], [8.2, 8.9, 8.5, 8.5])
+    # void corner, missing tile, missing position
+    assert heights[0] == pytest.approx(1000.0)
+    assert np.isnan(heights[1:]).all()
+
+
+@pytest.mark.parametrize('only_missing, expected', [
+    (False, [150.0, 150.0, 20.0]),
+    (True, [10.0, 150.0, 20.0])])
+def test_correct_points(dem, only_missing, expected):
+    points = pd.DataFrame({'latitude': [45.5, 45.5, 47.5],
+                           'longitude': [8.5, 8.5, 8.5],
+                           'altitude': [10.0, None, 20.0]})
+    corrected = elevation.correct_points(points, dem, only_missing)
+    assert corrected['altitude'].tolist() == pytest.approx(expected)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Streaming exports of the store as GeoJSON, GPX and CSV.
+
+Run from the repository root: python -m pytest test/test_export.py
+"""
+
+import io
+import csv
+import json
+import xml.etree.ElementTree as ElementTree
+from pathlib import Path
+import pytest
+import pandas as pd
+import src.export as export
+import src.activity as activity
+
+FIT_FILE = Path(__file__).parent/'Move_2014_04_04_18_20_11_Running.fit'
+GPX = '{http://www.topografix.com/GPX/1/1}'
+
+
+def ride_session():
+    """A short ride, a year after the run of the FIT file and far from it."""
+    frames = pd.DataFrame({'sport': ['cycling'],
+                           'start_time': [pd.Timestamp('2015-06-01 08:00',
+                                                       tz='UTC')],
+                           'total_distance': [300.0],
+                           'total_elapsed_time': [60.0]})
+    points = pd.DataFrame({
+        'latitude': [46.0, 46.001, 46.002],
+        'longitude': [9.0, 9.001, 9.002],
+        'lap': 1,
+        'altitude': [500.0, None, 510.0],
+        'timestamp': pd.date_range('2015-06-01 08:00', periods=3,
+                                   freq='30s', tz='UTC'),
+        'heart_rate': None, 'cadence': None, 'speed': 5.0})
+    session = activity.Activity()
+    session.define_source_file('ride.gpx')
+    session.create_from_frames(frames, pd.DataFrame(), points,
+                               digest='e' * 40)
+    return(session)
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    run = activity.Activity()
+    run.define_source_file(str(FIT_FILE))
+    run.create_from_file()
+    run.remove_empty_points()
+    db = activity.Activities()
+    with db.writing():
+        db.add_activities([run, ride_session()])
+    return(db)
+
+
+def test_missing_time_is_null():
+    assert export._json_value(pd.NaT) is None
+    assert export._json_value(pd.Series([pd.NaT])[0]) is None
+
+
+def test_empty_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db = activity.Activities()
+    with db.writing():
+        pass
+    assert db.activities.columns.empty
+    for table in export.TABLES:
+        assert ''.join(export.iter_export('csv', table)) == ''
+    collection = ''.join(export.iter_export('geojson'))
+    assert collection == '{"type": "FeatureCollection", "features": [\n\n]}\n'
+
+
+def features(**filters):
+    collection = json.loads(''.join(export.iter_export('geojson',
+                                                       **filters)))
+    return(collection['features'])
+
+
+def test_geojson(library):
+    run, ride = features()
+    assert ride['geometry'] == {'type': 'LineString',
+                                'coordinates': [[9.0, 46.0], [9.001, 46.001],
+                                                [9.002, 46.002]]}
+    assert ride['properties']['sport'] == 'cycling'
+    assert ride['properties']['start_time'] == '2015-06-01T08:00:00+00:00'
+    assert ride['properties']['source_file_name'] == 'ride.gpx'
+    assert len(run['geometry']['coordinates']) == 1462
+
+
+@pytest.mark.parametrize('filters, expected', [
+    ({}, ['running', 'cycling']),
+    ({'sport': 'cycling'}, ['cycling']),
+    ({'start': '2015-01-01'}, ['cycling']),
+    ({'end': '2014-04-04'}, ['running']),
+    ({'start': '2014-04-05', 'end': '2015-05-31'}, [])])
+def test_filters(library, filters, expected):
+    assert [feature['properties']['sport']
+            for feature in features(**filters)] == expected
+
+
+def test_gpx(library):
+    root = ElementTree.fromstring(''.join(export.iter_export(
+        'gpx', sport='cycling')))
+    track, = root.findall(GPX + 'trk')
+    assert track.find(GPX + 'name').text == 'ride.gpx'
+    points = track.findall(GPX + 'trkseg/' + GPX + 'trkpt')
+    assert [point.get('lat') for point in points] == \
+        ['46.0000000', '46.0010000', '46.0020000']
+    assert [point.findtext(GPX + 'ele') for point in points] == \
+        ['500.0', None, '510.0']
+    assert points[1].findtext(GPX + 'time') == '2015-06-01T08:00:30Z'
+
+
+@pytest.mark.parametrize('table, rows', [('activities', 2), ('laps', 1),
+                                         ('points', 1462 + 3)])
+def test_csv(library, table, rows):
+    text = ''.join(export.iter_export('csv', table))
+    records = list(csv.DictReader(io.StringIO(text)))
+    assert len(records) == rows
+    assert set(record['activity_id'] for record in records) <= \
+        set(str(i) for i in library.activities['activity_id'])
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        export.iter_export('kml')
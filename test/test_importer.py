@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Bulk importer: files listed by --dry-run, and resume from the checkpoint
+of an interrupted import.
+
+Run from the repository root: python -m pytest test/test_importer.py
+"""
+
+import shutil
+from pathlib import Path
+import pytest
+import src.activity as activity
+import src.importer as importer
+
+FIT_FILE = Path(__file__).parent/'Move_2014_04_04_18_20_11_Running.fit'
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path/'data'
+    (folder/'2014').mkdir(parents=True)
+    shutil.copy(FIT_FILE, folder/'2014'/'run.fit')
+    (folder/'broken.gpx').write_text('not a track')
+    (folder/'notes.txt').write_text('not an activity')
+    return(folder)
+
+
+def test_dry_run_lists_files(folder, tmp_path, capsys):
+    checkpoint = tmp_path/'checkpoint.json'
+    state = importer.run(str(folder), workers=1, dry_run=True,
+                         checkpoint=checkpoint)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ['2 files to import, 0 already done',
+                     '  ' + str(folder/'broken.gpx'),
+                     '  ' + str(folder/'2014'/'run.fit')]
+    assert state == {'done': [], 'failed': []}
+    assert not checkpoint.exists()
+
+
+def test_checkpoint_resume(folder, tmp_path, capsys):
+    checkpoint = tmp_path/'checkpoint.json'
+    failed = [str(folder/'broken.gpx')]
+    importer.save_checkpoint(checkpoint, {'done': [], 'failed': failed})
+    state = importer.run(str(folder), workers=1, checkpoint=checkpoint)
+    assert state == {'done': [str(folder/'2014'/'run.fit')],
+                     'failed': failed}
+    assert importer.load_checkpoint(checkpoint) == state
+    table = activity.read_table('activities')
+    assert table['source_file_name'].tolist() == ['run.fit']
+    capsys.readouterr()
+    importer.run(str(folder), workers=1, checkpoint=checkpoint)
+    assert capsys.readouterr().out.startswith(
+        '0 files to import, 2 already done')
+
+
+def test_failed_file_in_checkpoint(folder, tmp_path):
+    checkpoint = tmp_path/'checkpoint.json'
+    state = importer.run(str(folder), workers=1, checkpoint=checkpoint)
+    assert state['failed'] == [str(folder/'broken.gpx')]
+    assert importer.load_checkpoint(checkpoint) == state
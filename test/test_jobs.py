@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Job queue of the background ingest: a path is queued once while in
+flight, and failed files are skipped until they change.
+
+Run from the repository root: python -m pytest test/test_jobs.py
+"""
+
+import os
+import queue
+import pytest
+import src.jobs as jobs
+
+
+@pytest.fixture
+def job_queue():
+    # no worker: the jobs stay queued
+    return(jobs.JobQueue(workers=0, maxsize=2))
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path/'run.gpx'
+    path.write_text('<gpx/>')
+    return(path)
+
+
+def test_in_flight_path_queued_once(job_queue, source):
+    job = job_queue.enqueue(str(source))
+    assert job_queue.enqueue(str(source)) is job
+    assert job_queue.progress() == {jobs.QUEUED: 1, jobs.RUNNING: 0,
+                                    jobs.DONE: 0, jobs.FAILED: 0, 'total': 1}
+
+
+def test_full_queue(job_queue, tmp_path):
+    for name in ('a.gpx', 'b.gpx'):
+        job_queue.enqueue(str(tmp_path/name))
+    with pytest.raises(queue.Full):
+        job_queue.enqueue(str(tmp_path/'c.gpx'))
+
+
+def test_failed_file_skipped_until_changed(job_queue, source, tmp_path):
+    job = job_queue.enqueue(str(source))
+    job_queue._finish(job, jobs.FAILED, 'bad file')
+    assert job_queue.has_failed(str(source))
+    assert job_queue.enqueue_folder(str(tmp_path), None) == []
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not job_queue.has_failed(str(source))
+
+
+def test_failure_not_due_to_the_file_is_forgotten(job_queue, source):
+    job = job_queue.enqueue(str(source))
+    job_queue._finish(job, jobs.FAILED, 'disk full', remember=False)
+    assert not job_queue.has_failed(str(source))
+
+
+def test_finished_jobs_pruned(job_queue, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'MAX_FINISHED', 3)
+    finished = []
+    for i in range(5):
+        job = jobs.Job(str(tmp_path/'{}.gpx'.format(i)))
+        job_queue.jobs[job.id] = job
+        job_queue._finish(job, jobs.DONE)
+        finished.append(job.id)
+    assert list(job_queue.jobs) == finished[2:]
+
+
+def test_same_content_parsed_once(job_queue, source, tmp_path):
+    copy = tmp_path/'copy.gpx'
+    copy.write_bytes(source.read_bytes())
+    first = job_queue.enqueue(str(source))
+    second = job_queue.enqueue(str(copy))
+    assert job_queue._start(first)
+    assert not job_queue._start(second)
+    job_queue._finish(first, jobs.FAILED, 'bad file')
+    with pytest.raises(ValueError):
+        job_queue._start(jobs.Job(str(copy)))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Format detection from the content, through gzip, bz2 and zip archives,
+and the names of the files looked at.
+
+Run from the repository root: python -m pytest test/test_parse_activity_file.py
+"""
+
+import io
+import bz2
+import gzip
+import zipfile
+from pathlib import Path
+import pytest
+import src.parse_activity_file as parse_activity_file
+
+FIT_FILE = Path(__file__).parent/'Move_2014_04_04_18_20_11_Running.fit'
+
+# root tag after byte 512, past what ZipExtFile.peek returns
+GPX = (b'<?xml version="1.0" encoding="UTF-8"?>\n<!--' + b' ' * 1000 +
+       b'-->\n<gpx version="1.1" creator="test" '
+       b'xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>\n'
+       b'<trkpt lat="45.1" lon="8.1"><ele>200</ele>'
+       b'<time>2014-04-04T16:20:15Z</time></trkpt>\n'
+       b'<trkpt lat="45.2" lon="8.2"><ele>210</ele>'
+       b'<time>2014-04-04T16:21:15Z</time></trkpt>\n'
+       b'</trkseg></trk></gpx>\n')
+
+
+@pytest.mark.parametrize('member, content',
+                         [('run.gpx', GPX),
+                          ('run.gpx.gz', gzip.compress(GPX))],
+                         ids=['plain', 'gzip'])
+def test_long_prolog_in_zip_member(tmp_path, member, content):
+    archive = tmp_path/'export.zip'
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr(member, content)
+    activity, laps, points = parse_activity_file.parse_file(
+        archive/member)
+    assert points['latitude'].tolist() == [45.1, 45.2]
+
+
+COMPRESSIONS = {'plain': lambda content: content,
+                'gzip': gzip.compress,
+                'bz2': bz2.compress}
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+@pytest.mark.parametrize('file_format', ['fit', 'gpx'])
+def test_detect_format(file_format, compression):
+    content = FIT_FILE.read_bytes() if file_format == 'fit' else GPX
+    stream = parse_activity_file._buffered(
+        io.BytesIO(COMPRESSIONS[compression](content)))
+    stream = parse_activity_file._buffered(
+        parse_activity_file._decompress(stream))
+    assert parse_activity_file.detect_format(stream) == file_format
+    assert stream.read() == content
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_fit_in_zip_member_named_otherwise(tmp_path, compression):
+    # the format comes from the content, not the extension
+    archive = tmp_path/'export.zip'
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr('activities/1.gpx',
+                          COMPRESSIONS[compression](FIT_FILE.read_bytes()))
+    assert parse_activity_file.list_sources(archive) == \
+        [str(archive/'activities'/'1.gpx')]
+    activity, laps, points = parse_activity_file.parse_file(
+        archive/'activities'/'1.gpx')
+    assert len(points) == 1462
+
+
+@pytest.mark.parametrize('name, expected',
+                         [('run.fit', True), ('RUN.GPX.GZ', True),
+                          ('run.2014.04.tcx.bz2', True),
+                          ('export.zip', True), ('run.fit.tmp', False),
+                          ('notes.txt', False), ('fit', False)])
+def test_is_candidate(name, expected):
+    assert parse_activity_file.is_candidate(name) == expected
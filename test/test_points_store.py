@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Points and laps written to the memory-mapped store and read back one
+activity at a time.
+
+Run from the repository root: python -m pytest test/test_points_store.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import src.points_store as points_store
+import src.store as store
+
+
+def points_frame(activity_id, count, latitude=45.0):
+    return(pd.DataFrame({
+        'latitude': latitude + np.arange(count) * 0.001,
+        'longitude': 8.0 + np.arange(count) * 0.001,
+        'lap': 0.0,
+        'altitude': [200.0] + [np.nan] * (count - 1),
+        'timestamp': pd.date_range('2014-04-04 16:20:11', periods=count,
+                                   freq='s', tz='UTC'),
+        'heart_rate': 150.0,
+        'cadence': 80.0,
+        'speed': 3.0,
+        'activity_id': activity_id}))
+
+
+@pytest.fixture
+def frames():
+    # activities interleaved: the store sorts the rows by activity
+    points = pd.concat([points_frame(7, 3), points_frame(2, 4, 46.0),
+                        points_frame(7, 2, 47.0)], ignore_index=True)
+    laps = pd.DataFrame({
+        'start_time': [pd.Timestamp('2014-04-04 16:20:11', tz='UTC'),
+                       pd.NaT],
+        'total_distance': [1000.0, 2000.0],
+        'total_elapsed_time': [300.0, 600.0],
+        'max_speed': [4.0, 5.0],
+        'max_heart_rate': [170.0, 180.0],
+        'avg_heart_rate': [150.0, 160.0],
+        'activity_id': [2, 7]})
+    return(points, laps)
+
+
+def test_round_trip(tmp_path, frames):
+    points, laps = frames
+    points_store.write(points, laps, tmp_path/'store')
+    opened = points_store.PointsStore(folder=tmp_path)
+    for activity_id in (2, 7):
+        expected = points[points['activity_id'] == activity_id]
+        pd.testing.assert_frame_equal(
+            opened.points.get_frame(activity_id),
+            expected.reset_index(drop=True), check_dtype=False)
+        pd.testing.assert_frame_equal(
+            opened.laps.get_frame(activity_id),
+            laps[laps['activity_id'] == activity_id].reset_index(drop=True),
+            check_dtype=False)
+
+
+def test_unknown_activity_is_empty(tmp_path, frames):
+    points_store.write(*frames, tmp_path/'store')
+    opened = points_store.PointsStore(folder=tmp_path)
+    assert opened.points.get_frame(5).empty
+    assert list(opened.points.get(5)) == points_store.POINTS_COLUMNS
+
+
+def test_follows_the_current_version(tmp_path, frames):
+    points, laps = frames
+    store.commit(lambda folder: points_store.write(points, laps,
+                                                   folder/'store'),
+                 root=tmp_path)
+    opened = points_store.PointsStore(root=tmp_path)
+    pinned = points_store.PointsStore(folder=opened.folder)
+    assert len(opened.get_points(2)) == 4
+    store.commit(lambda folder: points_store.write(points.iloc[:0], laps,
+                                                   folder/'store'),
+                 root=tmp_path)
+    assert opened.get_points(2).empty
+    assert opened.version == 2
+    assert len(pinned.get_points(2)) == 4
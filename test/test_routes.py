@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Search of activities along the same route with MinHash and LSH.
+
+Run from the repository root: python -m pytest test/test_routes.py
+"""
+
+import numpy as np
+import pandas as pd
+import src.routes as routes
+
+
+def track(latitudes, longitudes) -> pd.DataFrame:
+    return(pd.DataFrame({'latitude': latitudes, 'longitude': longitudes}))
+
+
+def test_tracks_without_positions_are_not_similar():
+    index = routes.RouteIndex()
+    for activity_id in (1, 2, 3):
+        index.add(activity_id, routes.signature(routes.track_cells(
+            track([np.nan] * 5, [np.nan] * 5))))
+    assert index.query(1) == []
+    assert index.query(2) == []
+
+
+def road(start, end, latitude=45.0) -> pd.DataFrame:
+    """A track going east on a parallel, ~4 points per grid cell."""
+    longitudes = np.arange(start, end, routes.CELL_SIZE / 4)
+    return(track([latitude] * len(longitudes), longitudes))
+
+
+def route_signature(points: pd.DataFrame) -> np.ndarray:
+    return(routes.signature(routes.track_cells(points)))
+
+
+def test_similarity_estimates_jaccard():
+    first = route_signature(road(8.0, 8.2))
+    # same route recorded with fewer points, and in the other direction
+    assert routes.similarity(first, route_signature(
+        road(8.0, 8.2).iloc[::-3])) == 1.0
+    # 50 cells shared out of 150
+    assert abs(routes.similarity(first, route_signature(
+        road(8.1, 8.3))) - 1 / 3) < 0.15
+    assert routes.similarity(first, route_signature(
+        road(8.0, 8.2, latitude=46.0))) < 0.1
+
+
+def test_query_same_route():
+    index = routes.RouteIndex()
+    tracks = {1: road(8.0, 8.2), 2: road(8.0, 8.2).iloc[::2],
+              3: road(8.02, 8.2), 4: road(8.0, 8.2, latitude=46.0)}
+    for activity_id, points in tracks.items():
+        index.add(activity_id, route_signature(points))
+    found = index.query(1)
+    assert [activity_id for activity_id, score in found] == [2, 3]
+    assert found[0][1] == 1.0
+    assert index.query(4) == []
+    index.remove(2)
+    assert [activity_id for activity_id, score in index.query(1)] == [3]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Efforts on a segment: only in its direction, timed from the point
+closest to the start to the first point reaching the end.
+
+Run from the repository root: python -m pytest test/test_segments.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import src.segments as segments
+
+# a straight road going north, one point every 10 s and ~11 m
+NORTH = 45.0 + np.arange(101) * 0.0001
+
+SEGMENT = pd.Series({'segment_id': 1, 'name': 'climb',
+                     'start_latitude': 45.002, 'start_longitude': 8.0,
+                     'end_latitude': 45.008, 'end_longitude': 8.0,
+                     'radius': 30.0})
+
+
+def track(latitudes, activity_id=1, seconds=10):
+    return(pd.DataFrame({
+        'latitude': latitudes,
+        'longitude': 8.0,
+        'timestamp': pd.date_range('2021-05-01 07:00', tz='UTC',
+                                   periods=len(latitudes),
+                                   freq='{}s'.format(seconds)),
+        'activity_id': activity_id}))
+
+
+def test_effort_elapsed_time():
+    effort, = segments.match_efforts(SEGMENT, 1, track(NORTH))
+    # from 45.0020 (point 20) to 45.0078, the first within 30 m of the end
+    assert effort['elapsed_time'] == (78 - 20) * 10
+    assert effort['start_time'] == pd.Timestamp('2021-05-01 07:03:20',
+                                                tz='UTC')
+
+
+@pytest.mark.parametrize('latitudes, count', [
+    (NORTH[::-1], 0),
+    (np.concatenate([NORTH, NORTH[::-1]]), 1),
+    (np.concatenate([NORTH, NORTH[::-1], NORTH]), 2),
+    (NORTH[:60], 0)])
+def test_direction(latitudes, count):
+    assert len(segments.match_efforts(SEGMENT, 1, track(latitudes))) == count
+
+
+def test_leaderboard_across_activities():
+    points = pd.concat([track(NORTH, 1, seconds=10),
+                        track(NORTH[::-1], 2, seconds=5),
+                        track(NORTH, 3, seconds=5),
+                        track(NORTH + 1.0, 4, seconds=1)],
+                       ignore_index=True)
+    index = segments.GridIndex.from_points(points)
+    efforts = segments.match_segment(SEGMENT, points, index)
+    assert list(efforts.columns) == segments.EFFORT_COLUMNS
+    board = segments.leaderboard(efforts, 1)
+    assert board['activity_id'].tolist() == [3, 1]
+    assert board['elapsed_time'].tolist() == [290.0, 580.0]
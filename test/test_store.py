@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Versioned store: commits based on a stale version are refused, old
+versions are pruned, and readers retry a version removed under them.
+
+Run from the repository root: python -m pytest test/test_store.py
+"""
+
+import shutil
+import pytest
+import src.store as store
+import src.activity as activity
+
+
+def write_text(text):
+    def write(folder):
+        (folder/'table.txt').write_text(text)
+    return(write)
+
+
+def read_text(folder):
+    return((folder/'table.txt').read_text())
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    # the readers of src.activity use the default root, relative to the cwd
+    monkeypatch.chdir(tmp_path)
+    return(store.STORE_ROOT)
+
+
+def test_commit_on_stale_version_refused(root):
+    assert store.commit(write_text('first'), expected_version=0) == 1
+    assert store.commit(write_text('second'), expected_version=1) == 2
+    with pytest.raises(store.ConflictError):
+        store.commit(write_text('stale'), expected_version=1)
+    assert read_text(store.current_folder()) == 'second'
+
+
+def test_old_versions_pruned(root):
+    for version in range(1, 6):
+        store.commit(write_text(str(version)))
+    kept = sorted(folder.name for folder in root.glob('v*'))
+    assert kept == ['v{:06d}'.format(version) for version in
+                    range(6 - store.KEEP_VERSIONS, 6)]
+    assert store.read_manifest() == {'version': 5, 'folder': 'v000005'}
+
+
+def test_snapshot_retried_when_version_removed(root):
+    store.commit(write_text('old'))
+    folders = []
+
+    def read(folder):
+        folders.append(folder.name)
+        if len(folders) == 1:
+            # a writer commits and prunes the version being read
+            store.commit(write_text('new'))
+            shutil.rmtree(folder)
+        return(read_text(folder))
+
+    manifest, text = activity.read_snapshot(read)
+    assert (manifest['version'], text) == (2, 'new')
+    assert folders == ['v000001', 'v000002']
+
+
+def test_snapshot_gives_up(root):
+    store.commit(write_text('old'))
+    shutil.rmtree(store.current_folder())
+    with pytest.raises(FileNotFoundError):
+        activity.read_snapshot(read_text, attempts=2)
+
+
+def test_concurrent_writers(root):
+    first = activity.Activities()
+    with first.writing():
+        pass
+    second = activity.Activities(reset=False)
+    with first.writing():
+        pass
+    with pytest.raises(store.ConflictError):
+        second.save_to_pickle()
+    # writing() starts from the latest version instead
+    with second.writing():
+        pass
+    assert second.version == 3